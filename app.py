@@ -14,33 +14,156 @@ Before running:
 4. Enable "Enable ActiveX and Socket Clients"
 """
 import logging
+import math
 
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, g, render_template, request, jsonify
+from flask_socketio import SocketIO, join_room, leave_room, rooms
+import os
 import threading
 import time
 from log import Logger
 from datetime import datetime
 import json
-from collections import deque
+from collections import defaultdict
 import pandas as pd
+from socketio import RedisManager
 
-from ib import TWSConnection
+from ib import MODES, FakeTWS, TWSConnection, SubscriptionRegistry
+from market import BAR_SIZES, DOWNSAMPLE_METHODS, DownsampleCache, TickStore, to_points
+from metrics import REGISTRY
+from stream import FORMATS, JSON, Broadcaster, BusClient, BusError, BusManager, BusServer, room
 
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
-logger = Logger(__name__, socketio)
+app.config['BROADCAST_INTERVAL'] = 0.1  # Seconds between coalesced price frames
+app.config['TICK_CAPACITY'] = 100_000  # Ticks kept in memory per symbol
+app.config['SNAPSHOT_POINTS'] = 500  # Points sent to a joining client
+app.config['CLIENT_MAX_INFLIGHT'] = 20  # Unacknowledged frames before a client's updates are conflated
+app.config['CLIENT_MAX_LAG'] = 30.0  # Seconds without an acknowledgement before a client is disconnected
+app.config['LOG_EMIT_INTERVAL'] = 0.25  # Seconds between log_append batches
+app.config['BAR_HISTORY'] = 1000  # Closed bars kept per symbol and bar size
+app.config['TICK_STORE_PATH'] = 'ticks'  # Directory of the on-disk tick history
+app.config['TICK_STORE_FLUSH_INTERVAL'] = 1.0  # Seconds between batched tick writes
+app.config['HISTORY_MAX_WIDTH'] = 4000  # Cap on the points of a downsampled /history request
+app.config['HISTORY_LOD_LEVELS'] = 64  # Cached levels of detail (symbol and bucket size pairs)
+app.config['DISPATCH_SHARDS'] = 1  # Tick processing workers, sharded by reqId
+app.config['DISPATCH_CAPACITY'] = 100_000  # Tick records queued per shard
+app.config['DISPATCH_POLICY'] = 'drop_oldest'  # drop_newest, drop_oldest or conflate when full
+app.config['IB_REQUEST_RATE'] = 50  # Outbound IB API messages per second
+app.config['IB_MARKET_DATA_LINES'] = 100  # Concurrent market data lines of the account
+app.config['IB_RECONNECT_DELAY'] = 1.0  # Seconds before the first reconnect, doubled per attempt
+app.config['IB_RECONNECT_MAX_DELAY'] = 60.0  # Cap on the reconnect backoff
+app.config['CONTRACT_CACHE_PATH'] = 'contracts.db'  # SQLite cache of resolved contracts
+app.config['DEPTH_ROWS'] = 10  # Order book rows requested and streamed per side
+app.config['MARKET_DATA_MODE'] = 'sampled'  # Default feed: sampled or tick_by_tick
+# Offline load testing: FAKE_TWS=1 replaces TWS with a synthetic tick source
+app.config['FAKE_TWS'] = os.environ.get('FAKE_TWS') == '1'
+app.config['FAKE_TWS_RATE'] = float(os.environ.get('FAKE_TWS_RATE', 10))  # Trades per second per symbol
+app.config['FAKE_TWS_SPEED'] = float(os.environ.get('FAKE_TWS_SPEED', 1))  # Multiple of real time
+# Scale-out: one ingest process (see ingest.py) owns TWS, any number of APP_MODE=web workers serve browsers
+app.config['APP_MODE'] = os.environ.get('APP_MODE', 'standalone')  # standalone, ingest or web
+app.config['BUS_PATH'] = os.environ.get('BUS_PATH', 'ib-flask.sock')  # Unix socket between ingest and workers
+app.config['BUS_REDIS_URL'] = os.environ.get('BUS_REDIS_URL')  # Optional: fan out Socket.IO events over Redis
+app.config['BUS_CAPACITY'] = 100_000  # Messages queued per web worker before the oldest are dropped
+app.config['BUS_TIMEOUT'] = 30.0  # Seconds a web worker waits for the ingest process to answer
+
+APP_MODES = ('standalone', 'ingest', 'web')
+mode = app.config['APP_MODE']
+if mode not in APP_MODES:
+    raise ValueError(f"Unknown APP_MODE {mode}, use one of {APP_MODES}")
+
+# In the split deployment every emit of the ingest process is relayed to the web workers
+bus = None
+socketio_options = {}
+if mode == 'ingest':
+    bus = BusServer(app.config['BUS_PATH'], app.config['BUS_CAPACITY'])
+elif mode == 'web':
+    bus = BusClient(app.config['BUS_PATH'], app.config['BUS_TIMEOUT'])
+if bus is not None:
+    # The bus runs on OS threads and blocking sockets
+    socketio_options['async_mode'] = 'threading'
+    if app.config['BUS_REDIS_URL']:
+        socketio_options['client_manager'] = RedisManager(app.config['BUS_REDIS_URL'], write_only=mode == 'ingest')
+    else:
+        socketio_options['client_manager'] = BusManager(bus, write_only=mode == 'ingest')
+socketio = SocketIO(app, cors_allowed_origins="*", **socketio_options)
+# Callers only enqueue; file writes and client updates happen on a writer thread
+logger = Logger(__name__, socketio, queued=True, emit_interval=app.config['LOG_EMIT_INTERVAL'])
 
 # Global variables
-price_data = deque(maxlen=500)  # Store last 500 price points
-log_messages = deque(maxlen=100)  # Store last 100 log messages
 current_symbol = "AAPL"
+clients = {}  # sid -> (price format, watched symbol) of the Socket.IO clients of this process
+
+# Metrics exposed at /metrics; hot-path metrics are defined next to their code
+HTTP_SECONDS = REGISTRY.histogram('http_request_seconds', 'Flask request handling time', ['route'])
+CONNECTED_CLIENTS = REGISTRY.gauge('socketio_connected_clients', 'Connected Socket.IO clients')
+CONNECTED_CLIENTS.set(0)
+REGISTRY.gauge('log_queue_depth', 'Log messages waiting for the writer thread', callback=logger.queue_depth)
+
+# Web workers hold no market data; everything below lives in the ingest (or standalone) process
+if mode != 'web':
+    subscriptions = SubscriptionRegistry(app.config['TICK_CAPACITY'], app.config['BAR_HISTORY'])
+
+    # Persistent tick history, written off the IB reader thread
+    tick_store = TickStore(app.config['TICK_STORE_PATH'], app.config['TICK_STORE_FLUSH_INTERVAL'])
+    # Ticks can take two flush intervals to reach the disk, so younger buckets are not cached
+    history_lod = DownsampleCache(tick_store, 2 * app.config['TICK_STORE_FLUSH_INTERVAL'],
+                                  app.config['HISTORY_LOD_LEVELS'])
+
+    # Global TWS connection
+    tws = TWSConnection(logger, socketio, subscriptions, tick_store, app.config['DISPATCH_SHARDS'],
+                        app.config['DISPATCH_CAPACITY'], app.config['DISPATCH_POLICY'],
+                        app.config['IB_REQUEST_RATE'], app.config['IB_MARKET_DATA_LINES'],
+                        app.config['IB_RECONNECT_DELAY'], app.config['IB_RECONNECT_MAX_DELAY'],
+                        app.config['CONTRACT_CACHE_PATH'], app.config['DEPTH_ROWS'])
+    if app.config['FAKE_TWS']:
+        FakeTWS(app.config['FAKE_TWS_RATE'], app.config['FAKE_TWS_SPEED']).attach(tws)
+
+    # Coalesce ticks into delta frames instead of emitting on every tick
+    broadcaster = Broadcaster(socketio, subscriptions, app.config['BROADCAST_INTERVAL'],
+                              app.config['SNAPSHOT_POINTS'], tws.books, logger.snapshot,
+                              app.config['CLIENT_MAX_INFLIGHT'], app.config['CLIENT_MAX_LAG'], logger)
+    logger.lagging = broadcaster.lagging
+    broadcaster.start()
 
-# Global TWS connection
-tws = TWSConnection(logger, log_messages, socketio, price_data)
+    REGISTRY.gauge('subscriptions_active', 'Active market data subscriptions', callback=lambda: len(subscriptions))
+    REGISTRY.gauge('tick_buffer_ticks', 'Ticks held in memory per symbol', ['symbol'],
+                   callback=lambda: {(s.symbol,): len(s.ticks) for s in subscriptions})
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    HTTP_SECONDS.labels(request.endpoint or 'unknown').observe(time.perf_counter() - g.request_start)
+    return response
+
+def forward_request():
+    """Web worker: run the request in the ingest process, which owns the TWS connection
+
+    Only static files and the worker's own /metrics are served locally;
+    /metrics?source=ingest returns the ingest process metrics.
+    """
+    if request.endpoint == 'static' or (request.endpoint == 'metrics' and request.args.get('source') != 'ingest'):
+        return None
+    try:
+        body, status_code, mimetype = bus.call('http', method=request.method, path=request.path,
+                                               query=request.query_string.decode(),
+                                               body=request.get_json(silent=True))
+    except BusError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return Response(body, status_code, mimetype=mimetype)
+
+if mode == 'web':
+    app.before_request(forward_request)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -65,33 +188,163 @@ def disconnect_tws():
 
 @app.route('/subscribe', methods=['POST'])
 def subscribe_symbol():
-    """Subscribe to market data for a symbol"""
+    """Add a symbol, or a list of symbols, to the set of market data subscriptions"""
     global current_symbol
     data = request.json
-    symbol = data.get('symbol', 'AAPL').upper()
+    symbols = [s.upper() for s in data.get('symbols', [])] or [data.get('symbol', 'AAPL').upper()]
+    mode = data.get('mode', app.config['MARKET_DATA_MODE'])
+    if mode not in MODES:
+        return jsonify({'success': False, 'error': f'Unknown mode {mode}, use one of {list(MODES)}'}), 400
 
     if tws.connected:
-        # Cancel previous subscription
-        tws.cancel_market_data()
-        time.sleep(0.5)
+        current_symbol = symbols[0]
+        handles = tws.subscribe_many(symbols, mode)
+        return jsonify({
+            'success': handles is not None,
+            'symbol': current_symbol,
+            'symbols': subscriptions.symbols(),
+            # Requests are paced; clients follow them through subscription_status
+            'subscriptions': [s.status() for s in handles or []]
+        })
+    else:
+        return jsonify({'success': False, 'error': 'Not connected to TWS'})
+
+@app.route('/unsubscribe', methods=['POST'])
+def unsubscribe_symbol():
+    """Remove a symbol from the set of market data subscriptions"""
+    data = request.json
+    symbol = data.get('symbol', '').upper()
 
-        # Clear previous data
-        price_data.clear()
+    success = tws.cancel_market_data(symbol)
+    return jsonify({'success': success, 'symbol': symbol, 'symbols': subscriptions.symbols()})
 
-        # Subscribe to new symbol
-        current_symbol = symbol
-        success = tws.request_market_data(symbol)
-        return jsonify({'success': success, 'symbol': current_symbol})
-    else:
+@app.route('/mode', methods=['POST'])
+def set_mode():
+    """Switch a subscribed symbol between sampled and tick-by-tick data"""
+    data = request.json
+    symbol = data.get('symbol', '').upper()
+    mode = data.get('mode')
+    if mode not in MODES:
+        return jsonify({'success': False, 'error': f'Unknown mode {mode}, use one of {list(MODES)}'}), 400
+
+    subscription = tws.set_market_data_mode(symbol, mode)
+    if subscription is None:
+        return jsonify({'success': False, 'error': f'Not subscribed to {symbol}'}), 404
+    return jsonify({'success': True, **subscription.status()})
+
+@app.route('/subscriptions')
+def subscription_list():
+    """Get the state of the current subscriptions, or of one reqId"""
+    req_id = request.args.get('reqId', type=int)
+    if req_id is None:
+        return jsonify({'subscriptions': [s.status() for s in subscriptions]})
+
+    subscription = subscriptions.lookup(req_id)
+    if subscription is None:
+        return jsonify({'success': False, 'error': f'Unknown reqId {req_id}'}), 404
+    return jsonify(subscription.status())
+
+@app.route('/depth/subscribe', methods=['POST'])
+def subscribe_depth():
+    """Start streaming the order book of a symbol"""
+    data = request.json
+    symbol = data.get('symbol', current_symbol).upper()
+    book = tws.request_market_depth(symbol, data.get('rows'))
+    if book is None:
         return jsonify({'success': False, 'error': 'Not connected to TWS'})
+    return jsonify({'success': True, 'symbol': symbol, 'reqId': book.req_id, 'rows': book.rows})
+
+@app.route('/depth/unsubscribe', methods=['POST'])
+def unsubscribe_depth():
+    """Stop the order book of a symbol"""
+    symbol = request.json.get('symbol', '').upper()
+    return jsonify({'success': tws.cancel_market_depth(symbol), 'symbol': symbol})
+
+@app.route('/depth')
+def depth():
+    """Get the current order book of a symbol, optionally only the top rows"""
+    symbol = request.args.get('symbol', current_symbol).upper()
+    book = tws.book(symbol)
+    if book is None:
+        return jsonify({'success': False, 'error': f'No market depth for {symbol}'}), 404
+    return jsonify({'symbol': symbol, **book.snapshot(request.args.get('rows', type=int))})
 
 @app.route('/status')
 def status():
     """Get connection status"""
     return jsonify({
         'connected': tws.connected,
+        'reconnecting': tws.auto_reconnect and not tws.connected,
+        'reconnect_attempts': tws.supervisor.attempts,
         'symbol': current_symbol,
-        'data_points': len(price_data)
+        'symbols': subscriptions.symbols(),
+        'data_points': sum(len(s.ticks) for s in subscriptions)
+    })
+
+@app.route('/bars')
+def bars():
+    """Get OHLCV bars for a subscribed symbol, including the open bar"""
+    symbol = request.args.get('symbol', current_symbol).upper()
+    size = request.args.get('size', '1m')
+
+    if size not in BAR_SIZES:
+        return jsonify({'success': False, 'error': f'Unknown bar size {size}, use one of {list(BAR_SIZES)}'}), 400
+    subscription = subscriptions.by_symbol(symbol)
+    if subscription is None:
+        return jsonify({'success': False, 'error': f'Not subscribed to {symbol}'}), 404
+
+    return jsonify({'success': True, 'symbol': symbol, 'size': size, 'bars': subscription.bars.bars(size)})
+
+def parse_time(value, default):
+    """Parse epoch seconds or an ISO 8601 string into epoch nanoseconds"""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp() * 1_000_000_000)
+    if not math.isfinite(seconds):
+        raise ValueError(f"Invalid time: {value}")
+    return int(seconds * 1_000_000_000)
+
+@app.route('/history')
+def history():
+    """Get stored ticks for a symbol between two times (today by default)
+
+    With ``width`` (the chart width in pixels) the ticks are downsampled to
+    about that many points with ``method`` lttb (the default) or minmax.
+    """
+    symbol = request.args.get('symbol', current_symbol).upper()
+    now = time.time_ns()
+    start_of_day = int(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp() * 1_000_000_000)
+    try:
+        start = parse_time(request.args.get('from'), start_of_day)
+        end = parse_time(request.args.get('to'), now)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    width = request.args.get('width', type=int)
+    if width is None:
+        ticks = tick_store.read(symbol, start, end)
+        return jsonify({
+            'success': True,
+            'symbol': symbol,
+            'count': len(ticks),
+            'data': to_points(ticks['ts'], ticks['price'])
+        })
+
+    method = request.args.get('method', 'lttb')
+    if method not in DOWNSAMPLE_METHODS:
+        return jsonify({'success': False, 'error': f'Unknown method {method}, use one of {list(DOWNSAMPLE_METHODS)}'}), 400
+    width = min(max(width, 3), app.config['HISTORY_MAX_WIDTH'])
+    ts, price, count = history_lod.downsample(symbol, start, end, width, method)
+    return jsonify({
+        'success': True,
+        'symbol': symbol,
+        'count': count,
+        'method': method,
+        'width': width,
+        'data': to_points(ts, price)
     })
 
 @app.route('/log/clear', methods=['POST'])
@@ -99,28 +352,136 @@ def clear_logs():
     logger.clear()
     return "", 202
 
+def watch_client(sid, fmt, symbol, logs=False):
+    """Point a client at a symbol and price format; the broadcaster sends its snapshots with the next frame"""
+    broadcaster.watch(sid, fmt, symbol, logs)
+
+def leave_client(sid):
+    broadcaster.forget(sid)
+
+def ack_client(sid, seq):
+    broadcaster.ack(sid, seq)
+
+CLIENT_METHODS = {'watch': watch_client, 'leave': leave_client, 'ack': ack_client}
+
+def client_call(method, **kwargs):
+    """Run a client operation where the market data is: here, or in the ingest process"""
+    if mode != 'web':
+        return CLIENT_METHODS[method](**kwargs)
+    try:
+        return bus.call(method, **kwargs)
+    except BusError as e:
+        # The client is registered again when the bus reconnects
+        logger.error(f"Client {method} failed: {str(e)}")
+        return None
+
+def watch(fmt, symbol, logs=False):
+    """Move the requesting client to the room of a symbol in a price format"""
+    target = room(symbol, fmt)
+    for joined in rooms():
+        if joined not in (request.sid, target):
+            leave_room(joined)
+    join_room(target)
+    clients[request.sid] = (fmt, symbol)
+    client_call('watch', sid=request.sid, fmt=fmt, symbol=symbol, logs=logs)
+
 @socketio.on('connect')
-def handle_connect():
-    """Handle client connection"""
-    emit('log_update', list(log_messages))
-    if price_data:
-        emit('price_update', {
-            'symbol': current_symbol,
-            'price': price_data[-1]['price'] if price_data else 0,
-            'timestamp': price_data[-1]['timestamp'] if price_data else '',
-            'data': list(price_data)
-        })
+def handle_connect(auth=None):
+    """Handle client connection
+
+    Clients pick the price format and the symbol they watch with
+    ``io({auth: {format: 'binary', symbol: 'AAPL'}})``; the format defaults
+    to JSON. Only a joining client gets the full window and the logs;
+    everyone else receives deltas.
+    """
+    CONNECTED_CLIENTS.inc()
+    auth = auth or {}
+    fmt = auth.get('format')
+    watch(fmt if fmt in FORMATS else JSON, (auth.get('symbol') or current_symbol).upper(), logs=True)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    CONNECTED_CLIENTS.dec()
+    clients.pop(request.sid, None)
+    client_call('leave', sid=request.sid)
+
+@socketio.on('set_format')
+def handle_set_format(data):
+    """Switch the price format of a connected client and resend the window in it"""
+    fmt = data.get('format')
+    if fmt not in FORMATS or request.sid not in clients:
+        return
+    watch(fmt, clients[request.sid][1])
+
+@socketio.on('request_snapshot')
+def handle_request_snapshot(data):
+    """Switch a client to another symbol and send it the full window"""
+    symbol = data.get('symbol', '').upper()
+    if symbol and request.sid in clients:
+        watch(clients[request.sid][0], symbol)
+
+@socketio.on('ack')
+def handle_ack(data):
+    """A client received every frame up to ``seq``; clients that stop acking get conflated, then dropped"""
+    seq = data.get('seq')
+    if isinstance(seq, int) and request.sid in clients:
+        client_call('ack', sid=request.sid, seq=seq)
+
+# Ingest process side of the bus
+worker_clients = defaultdict(set)  # bus peer -> sids of the clients of that web worker
+
+def serve_worker(peer, method, kwargs):
+    """Ingest process: answer a request of a web worker"""
+    if method == 'http':
+        return forwarded_request(**kwargs)
+    if method == 'watch':
+        worker_clients[peer].add(kwargs['sid'])
+    elif method == 'leave':
+        worker_clients[peer].discard(kwargs['sid'])
+    return CLIENT_METHODS[method](**kwargs)
+
+def forget_worker(peer):
+    """Ingest process: a web worker went away, and its clients with it"""
+    for sid in worker_clients.pop(peer, ()):
+        leave_client(sid)
+
+def forwarded_request(method, path, query, body):
+    """Ingest process: run an HTTP request forwarded by a web worker through the Flask routes"""
+    with app.test_request_context(path, method=method, query_string=query, json=body):
+        response = app.full_dispatch_request()
+        return response.get_data(), response.status_code, response.mimetype
+
+def rejoin_clients():
+    """Web worker: register the connected clients with a (re)started ingest process, which catches them up"""
+    for sid, (fmt, symbol) in list(clients.items()):
+        try:
+            bus.call('watch', sid=sid, fmt=fmt, symbol=symbol, logs=True)
+        except BusError as e:
+            logger.error(f"Rejoining client {sid} failed: {str(e)}")
+            return
+
+if mode == 'web':
+    bus.start(logger, on_connect=rejoin_clients)
+    if isinstance(socketio.server.manager, BusManager):
+        # Listen to the bus right away rather than from the first client connect on
+        socketio.server.manager.initialize()
 
 if __name__ == '__main__':
     # Add some initial log messages
     logger.info("Flask TWS application started")
 
+    # Several web workers run side by side on their own PORT; the reloader would add a phantom one
+    port = int(os.environ.get('PORT', 8000))
+    use_reloader = mode == 'standalone'
+
     # Start the Flask-SocketIO server with proper configuration
     try:
         # Try with eventlet first
-        socketio.run(app, debug=True, host='127.0.0.1', port=8000, allow_unsafe_werkzeug=True)
+        socketio.run(app, debug=True, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True,
+                     use_reloader=use_reloader)
     except Exception as e:
         print(f"Failed to start with eventlet: {e}")
         print("Trying with threading...")
         # Fallback to threading
-        socketio.run(app, debug=True, host='127.0.0.1', port=8000, allow_unsafe_werkzeug=True, async_mode='threading')
\ No newline at end of file
+        socketio.run(app, debug=True, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True,
+                     use_reloader=use_reloader, async_mode='threading')
\ No newline at end of file
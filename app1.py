@@ -1,32 +1,60 @@
 import streamlit as st
 from streamlit_lightweight_charts import renderLightweightCharts
 
-import json
+import logging
+from datetime import date, timedelta
 import numpy as np
-import yfinance as yf
 import pandas as pd
-import pandas_ta as ta
+
+from ib import TWSConnection
+from market import HistoricalBarCache
 
 COLOR_BULL = 'rgba(38,166,154,0.9)' # #26a69a
 COLOR_BEAR = 'rgba(239,83,80,0.9)'  # #ef5350
 
-# Request historic pricing data via finance.yahoo.com API
-df = yf.Ticker('AAPL').history(period='4mo')[['Open', 'High', 'Low', 'Close', 'Volume']]
+SYMBOL = 'AAPL'
+BAR_SIZE = '1 day'
+
+
+@st.cache_resource
+def connect_tws(host='127.0.0.1', port=4002, client_id=2):
+    """Connect once per server process; reruns reuse the connection
+
+    ``start_connect`` itself waits for TWS to acknowledge the connection; if
+    it is not up, ``load_bars`` serves from the cache alone and the
+    connection's supervisor keeps trying in the background.
+    """
+    tws = TWSConnection(logging.getLogger('app1'), None)
+    tws.start_connect(host, port, client_id, timeout=2)
+    return tws
+
+
+@st.cache_data(ttl=60)
+def load_bars(symbol, bar_size, start, end):
+    """Serve bars from the local cache, fetching only missing ranges from TWS"""
+    tws = connect_tws()
+    cache = HistoricalBarCache('history', tws.fetch_historical_bars if tws.connected else None)
+    return cache.get(symbol, bar_size, start, end)
+
+
+# Historic bars for the last 4 months, read from the local Parquet cache
+df = load_bars(SYMBOL, BAR_SIZE, date.today() - timedelta(days=122), date.today())
+if df.empty:
+    st.warning("No cached bars and TWS is not reachable")
+    st.stop()
 
 # Some data wrangling to match required format
-df = df.reset_index()
-df.columns = ['time','open','high','low','close','volume']                  # rename columns
+df = df.copy()
 df['time'] = df['time'].dt.strftime('%Y-%m-%d')                             # Date to string
 df['color'] = np.where(  df['open'] > df['close'], COLOR_BEAR, COLOR_BULL)  # bull or bear
-df.ta.macd(close='close', fast=6, slow=12, signal=5, append=True)           # calculate macd
 
-# export to JSON format
-candles = json.loads(df.to_json(orient = "records"))
-volume = json.loads(df.rename(columns={"volume": "value",}).to_json(orient = "records"))
-macd_fast = json.loads(df.rename(columns={"MACDh_6_12_5": "value"}).to_json(orient = "records"))
-macd_slow = json.loads(df.rename(columns={"MACDs_6_12_5": "value"}).to_json(orient = "records"))
+# export to chart records; MACD columns come precomputed from the cache
+candles = df[['time', 'open', 'high', 'low', 'close', 'color']].to_dict('records')
+volume = df[['time', 'volume', 'color']].rename(columns={"volume": "value",}).to_dict('records')
+macd_fast = df[['time', 'MACDh_6_12_5']].rename(columns={"MACDh_6_12_5": "value"}).dropna().to_dict('records')
+macd_slow = df[['time', 'MACDs_6_12_5']].rename(columns={"MACDs_6_12_5": "value"}).dropna().to_dict('records')
 df['color'] = np.where(  df['MACD_6_12_5'] > 0, COLOR_BULL, COLOR_BEAR)  # MACD histogram color
-macd_hist = json.loads(df.rename(columns={"MACD_6_12_5": "value"}).to_json(orient = "records"))
+macd_hist = df[['time', 'MACD_6_12_5', 'color']].rename(columns={"MACD_6_12_5": "value"}).dropna().to_dict('records')
 
 
 chartMultipaneOptions = [
@@ -64,7 +92,7 @@ chartMultipaneOptions = [
             "horzAlign": 'center',
             "vertAlign": 'center',
             "color": 'rgba(171, 71, 188, 0.3)',
-            "text": 'AAPL - D1',
+            "text": f'{SYMBOL} - D1',
         }
     },
     {
@@ -1,14 +1,11 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import threading
 import time
+from collections import deque
 from datetime import datetime
-import queue
 import logging
-from io import StringIO
-import sys
 
 # TWS API imports
 from ibapi.client import EClient
@@ -17,36 +14,95 @@ from ibapi.contract import Contract
 from ibapi.ticktype import TickTypeEnum
 
 
+# Tick columns of PriceWindow, by TWS tick type
+PRICE_COLUMNS = {1: 0, 2: 1, 4: 2}  # BID=1, ASK=2, LAST=4
+COLUMN_NAMES = ('bid', 'ask', 'last')
+
+WINDOW_ROWS = 100  # One row per second
+MAX_LOGS = 50
+MIN_REFRESH = 0.1  # Shortest time between two redraws
+
+
 class StreamlitLogHandler(logging.Handler):
     """Custom log handler to capture logs for Streamlit display"""
 
-    def __init__(self):
+    def __init__(self, updated=None):
         super().__init__()
-        self.log_queue = queue.Queue()
+        self.log_queue = deque()
+        self.updated = updated
 
     def emit(self, record):
-        log_entry = self.format(record)
-        self.log_queue.put(log_entry)
+        self.log_queue.append(self.format(record))
+        if self.updated is not None:
+            self.updated.set()
 
     def get_logs(self):
-        logs = []
-        while not self.log_queue.empty():
-            try:
-                logs.append(self.log_queue.get_nowait())
-            except queue.Empty:
-                break
-        return logs
+        # Only this many entries are there to pop; later ones wait for the next call
+        return [self.log_queue.popleft() for _ in range(len(self.log_queue))]
+
+
+class PriceWindow:
+    """Per-second bid/ask/last rows in preallocated NumPy columns
+
+    Ticks are folded into the newest row while they fall in the same second,
+    otherwise they open a new row that carries the other prices forward. Rows
+    are written in place; only when the slack at the end is used up are the
+    newest ``capacity`` rows copied back to the front. Folding a batch costs
+    O(batch), and ``view`` hands the chart contiguous slices of the price
+    columns; only the times are copied, to shift them to local time.
+    """
+
+    def __init__(self, capacity=WINDOW_ROWS, bucket_ns=1_000_000_000):
+        self.capacity = capacity
+        self.bucket_ns = bucket_ns
+        self._allocated = 2 * capacity
+        self.ts = np.empty(self._allocated, dtype=np.int64)
+        self.prices = np.full((self._allocated, len(COLUMN_NAMES)), np.nan)
+        self.end = 0
+
+    def fold(self, ticks):
+        """Fold ``(ts_ns, column, price)`` ticks, oldest first"""
+        ts_col, prices = self.ts, self.prices
+        end = self.end
+        for ts, column, price in ticks:
+            if end and ts - ts_col[end - 1] < self.bucket_ns:
+                prices[end - 1, column] = price
+                continue
+            if end == self._allocated:
+                ts_col[:self.capacity] = ts_col[end - self.capacity:end]
+                prices[:self.capacity] = prices[end - self.capacity:end]
+                end = self.capacity
+            ts_col[end] = ts
+            prices[end] = prices[end - 1] if end else np.nan
+            prices[end, column] = price
+            end += 1
+        self.end = end
+
+    def view(self):
+        """(local datetime64 times, prices) of the newest ``capacity`` rows"""
+        start = max(0, self.end - self.capacity)
+        # Chart local wall-clock time, like datetime.now() used to
+        offset = int(datetime.now().astimezone().utcoffset().total_seconds() * 1_000_000_000)
+        return (self.ts[start:self.end] + offset).view('datetime64[ns]'), self.prices[start:self.end]
+
+    def latest(self):
+        return self.prices[self.end - 1] if self.end else None
+
+    def __len__(self):
+        return min(self.end, self.capacity)
 
 
 class TWSApp(EWrapper, EClient):
     def __init__(self):
         EClient.__init__(self, self)
-        self.price_data = queue.Queue()
+        # (ts_ns, column, price) ticks; the dashboard drains them in bulk when woken up
+        self.price_data = deque()
+        self.updated = threading.Event()
         self.logger = logging.getLogger('TWS')
         self.logger.setLevel(logging.INFO)
 
         # Create custom handler for Streamlit
-        self.log_handler = StreamlitLogHandler()
+        self.log_handler = StreamlitLogHandler(self.updated)
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         self.log_handler.setFormatter(formatter)
         self.logger.addHandler(self.log_handler)
@@ -60,25 +116,19 @@ class TWSApp(EWrapper, EClient):
     def connectAck(self):
         self.logger.info("Connected to TWS")
         self.connected = True
+        self.updated.set()
 
     def connectionClosed(self):
         self.logger.info("Connection closed")
         self.connected = False
+        self.updated.set()
 
     def tickPrice(self, reqId, tickType, price, attrib):
-        tick_name = TickTypeEnum.to_str(tickType)
-        timestamp = datetime.now()
-
         # Only process BID, ASK, and LAST prices
-        if tickType in [1, 2, 4]:  # BID=1, ASK=2, LAST=4
-            price_update = {
-                'timestamp': timestamp,
-                'type': tick_name,
-                'price': price,
-                'reqId': reqId
-            }
-            self.price_data.put(price_update)
-            self.logger.info(f"{tick_name}: ${price:.2f}")
+        column = PRICE_COLUMNS.get(tickType)
+        if column is not None:
+            self.price_data.append((time.time_ns(), column, price))
+            self.logger.info(f"{TickTypeEnum.to_str(tickType)}: ${price:.2f}")
 
     def tickSize(self, reqId, tickType, size):
         tick_name = TickTypeEnum.to_str(tickType)
@@ -86,13 +136,7 @@ class TWSApp(EWrapper, EClient):
             self.logger.info(f"{tick_name}: {size}")
 
     def get_price_updates(self):
-        updates = []
-        while not self.price_data.empty():
-            try:
-                updates.append(self.price_data.get_nowait())
-            except queue.Empty:
-                break
-        return updates
+        return [self.price_data.popleft() for _ in range(len(self.price_data))]
 
     def get_logs(self):
         return self.log_handler.get_logs()
@@ -113,6 +157,94 @@ def run_tws_app(app):
     app.run()
 
 
+def create_figure():
+    """The price chart, created once per session; refreshes only swap the trace data"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(mode='lines', name='Last Price', line=dict(color='blue', width=2)))
+    fig.add_trace(go.Scatter(mode='lines', name='Bid', line=dict(color='green', width=1)))
+    fig.add_trace(go.Scatter(mode='lines', name='Ask', line=dict(color='red', width=1)))
+    fig.update_layout(
+        height=400,
+        xaxis_title="Time",
+        yaxis_title="Price ($)",
+        showlegend=True,
+        margin=dict(l=0, r=0, t=0, b=0)
+    )
+    return fig
+
+
+def render_prices(state, chart_placeholder, current_price_placeholder, bid_ask_placeholder):
+    window = state.price_window
+    if not len(window):
+        chart_placeholder.info("No price data available yet. Connect to TWS and request market data.")
+        return
+
+    times, prices = window.view()
+    fig = state.figure
+    with fig.batch_update():
+        for trace, column in zip(fig.data, (2, 0, 1)):  # last, bid, ask
+            trace.x = times
+            trace.y = prices[:, column]
+    chart_placeholder.plotly_chart(fig, use_container_width=True, key="price_chart")
+
+    bid, ask, last = window.latest()
+    if not np.isnan(last):
+        current_price_placeholder.metric("Last Price", f"${last:.2f}")
+    with bid_ask_placeholder.container():
+        col1, col2 = st.columns(2)
+        with col1:
+            if not np.isnan(bid):
+                st.metric("Bid", f"${bid:.2f}")
+        with col2:
+            if not np.isnan(ask):
+                st.metric("Ask", f"${ask:.2f}")
+
+
+def render_logs(state, log_placeholder):
+    log_text = "\n".join(list(state.logs)[-10:]) if state.logs else "No logs yet..."  # Show last 10 logs
+    # A plain element rather than a text_area widget, so redraws update it in place
+    log_placeholder.code(log_text, language=None, height=200)
+
+
+@st.fragment(run_every=MIN_REFRESH)
+def live_view(chart_placeholder, current_price_placeholder, bid_ask_placeholder, log_placeholder,
+              status_placeholder):
+    """Redraw whatever changed since the last run
+
+    Runs as a fragment, so only it reruns every ``MIN_REFRESH`` seconds and
+    each run may redraw the chart under the same key. It draws into
+    placeholders outside its body, which keep their content on runs that
+    have nothing new.
+    """
+    state = st.session_state
+    app = state.tws_app
+    # A full rerun starts from empty placeholders, so it redraws everything once
+    redraw, state.redraw = state.redraw, False
+    if not app.updated.is_set() and not redraw:
+        return
+    app.updated.clear()
+
+    ticks = app.get_price_updates()
+    if ticks:
+        state.price_window.fold(ticks)
+    if ticks or redraw:
+        render_prices(state, chart_placeholder, current_price_placeholder, bid_ask_placeholder)
+
+    new_logs = app.get_logs()
+    if new_logs:
+        state.logs.extend(new_logs)
+    if new_logs or redraw:
+        render_logs(state, log_placeholder)
+
+    # Update connection status
+    if app.connected != state.connected:
+        state.connected = app.connected
+        if state.connected:
+            status_placeholder.success("✅ Connected to TWS")
+        else:
+            status_placeholder.error("❌ Disconnected from TWS")
+
+
 def main():
     st.set_page_config(
         page_title="Real-time Market Data",
@@ -125,9 +257,10 @@ def main():
     # Initialize session state
     if 'tws_app' not in st.session_state:
         st.session_state.tws_app = TWSApp()
-        st.session_state.price_history = pd.DataFrame(columns=['timestamp', 'bid', 'ask', 'last'])
+        st.session_state.price_window = PriceWindow()
+        st.session_state.figure = create_figure()
         st.session_state.connected = False
-        st.session_state.logs = []
+        st.session_state.logs = deque(maxlen=MAX_LOGS)
 
     # Top control panel
     col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
@@ -173,7 +306,7 @@ def main():
     with left_col:
         # Top left: Stock graph
         st.subheader(f"📊 {symbol} Price Chart")
-        chart_container = st.container()
+        chart_placeholder = st.empty()
 
         # Bottom left: Logger output
         st.subheader("📝 Log Output")
@@ -194,142 +327,10 @@ def main():
         current_price_placeholder = st.empty()
         bid_ask_placeholder = st.empty()
 
-    # Auto-refresh data
-    placeholder = st.empty()
-
-    # Main update loop
-    while True:
-        # Get new price updates
-        updates = st.session_state.tws_app.get_price_updates()
-
-        if updates:
-            # Process price updates
-            for update in updates:
-                timestamp = update['timestamp']
-                price_type = update['type']
-                price = update['price']
-
-                # Update price history
-                if len(st.session_state.price_history) == 0:
-                    new_row = pd.DataFrame({
-                        'timestamp': [timestamp],
-                        'bid': [price if price_type == 'BID' else None],
-                        'ask': [price if price_type == 'ASK' else None],
-                        'last': [price if price_type == 'LAST' else None]
-                    })
-                    st.session_state.price_history = new_row
-                else:
-                    # Update the last row or add new row
-                    last_time = st.session_state.price_history.iloc[-1]['timestamp']
-                    if (timestamp - last_time).total_seconds() < 1:  # Same second, update
-                        if price_type == 'BID':
-                            st.session_state.price_history.iloc[
-                                -1, st.session_state.price_history.columns.get_loc('bid')] = price
-                        elif price_type == 'ASK':
-                            st.session_state.price_history.iloc[
-                                -1, st.session_state.price_history.columns.get_loc('ask')] = price
-                        elif price_type == 'LAST':
-                            st.session_state.price_history.iloc[
-                                -1, st.session_state.price_history.columns.get_loc('last')] = price
-                    else:  # New second, add new row
-                        new_row = pd.DataFrame({
-                            'timestamp': [timestamp],
-                            'bid': [price if price_type == 'BID' else st.session_state.price_history.iloc[-1]['bid']],
-                            'ask': [price if price_type == 'ASK' else st.session_state.price_history.iloc[-1]['ask']],
-                            'last': [price if price_type == 'LAST' else st.session_state.price_history.iloc[-1]['last']]
-                        })
-                        st.session_state.price_history = pd.concat([st.session_state.price_history, new_row],
-                                                                   ignore_index=True)
-
-            # Keep only last 100 data points
-            if len(st.session_state.price_history) > 100:
-                st.session_state.price_history = st.session_state.price_history.tail(100).reset_index(drop=True)
-
-        # Update chart
-        with chart_container:
-            if len(st.session_state.price_history) > 0:
-                fig = make_subplots(specs=[[{"secondary_y": False}]])
-
-                df = st.session_state.price_history.dropna()
-                if len(df) > 0:
-                    # Plot lines
-                    if 'last' in df.columns and df['last'].notna().any():
-                        fig.add_trace(
-                            go.Scatter(x=df['timestamp'], y=df['last'],
-                                       mode='lines', name='Last Price',
-                                       line=dict(color='blue', width=2))
-                        )
-
-                    if 'bid' in df.columns and df['bid'].notna().any():
-                        fig.add_trace(
-                            go.Scatter(x=df['timestamp'], y=df['bid'],
-                                       mode='lines', name='Bid',
-                                       line=dict(color='green', width=1))
-                        )
-
-                    if 'ask' in df.columns and df['ask'].notna().any():
-                        fig.add_trace(
-                            go.Scatter(x=df['timestamp'], y=df['ask'],
-                                       mode='lines', name='Ask',
-                                       line=dict(color='red', width=1))
-                        )
-
-                fig.update_layout(
-                    height=400,
-                    xaxis_title="Time",
-                    yaxis_title="Price ($)",
-                    showlegend=True,
-                    margin=dict(l=0, r=0, t=0, b=0)
-                )
-
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No price data available yet. Connect to TWS and request market data.")
-
-        # Update current price display
-        with current_price_placeholder:
-            if len(st.session_state.price_history) > 0:
-                latest = st.session_state.price_history.iloc[-1]
-                if pd.notna(latest['last']):
-                    st.metric("Last Price", f"${latest['last']:.2f}")
-
-        with bid_ask_placeholder:
-            if len(st.session_state.price_history) > 0:
-                latest = st.session_state.price_history.iloc[-1]
-                col1, col2 = st.columns(2)
-                with col1:
-                    if pd.notna(latest['bid']):
-                        st.metric("Bid", f"${latest['bid']:.2f}")
-                with col2:
-                    if pd.notna(latest['ask']):
-                        st.metric("Ask", f"${latest['ask']:.2f}")
-
-        # Update logs
-        new_logs = st.session_state.tws_app.get_logs()
-        if new_logs:
-            st.session_state.logs.extend(new_logs)
-            # Keep only last 50 log entries
-            if len(st.session_state.logs) > 50:
-                st.session_state.logs = st.session_state.logs[-50:]
-
-        with log_placeholder:
-            if st.session_state.logs:
-                log_text = "\n".join(st.session_state.logs[-10:])  # Show last 10 logs
-                st.text_area("Recent Logs", value=log_text, height=200, key=f"logs_{time.time()}")
-            else:
-                st.text_area("Recent Logs", value="No logs yet...", height=200, key=f"logs_empty_{time.time()}")
-
-        # Update connection status
-        if st.session_state.tws_app.connected != st.session_state.connected:
-            st.session_state.connected = st.session_state.tws_app.connected
-            if st.session_state.connected:
-                st.success("✅ Connected to TWS")
-            else:
-                st.error("❌ Disconnected from TWS")
-
-        # Sleep briefly before next update
-        time.sleep(0.5)
-
+    status_placeholder = st.empty()
+    st.session_state.redraw = True
+    live_view(chart_placeholder, current_price_placeholder, bid_ask_placeholder, log_placeholder,
+              status_placeholder)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
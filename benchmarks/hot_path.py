@@ -0,0 +1,197 @@
+"""
+Benchmarks for the tick-to-browser hot path
+
+Drives TWSConnection.tickPrice/tickSize as fast as possible for a grid of
+symbol and client counts while the real Broadcaster and queued Logger run on
+their own threads, and reports per case:
+
+- ticks_per_sec: sustained throughput, until the dispatch queue is drained
+- cpu_us_per_tick: process CPU time (all threads) per tick
+- alloc_blocks_per_tick / alloc_bytes_per_tick: memory blocks and bytes still
+  allocated per tick after the run (tracemalloc, separate pass)
+- emit_bytes_per_tick: bytes sent to all clients per tick, in the ``--format``
+  wire format (binary attachments count their raw size); every symbol is
+  watched by ``--clients`` clients
+- latency_p50_us / latency_p99_us: tickPrice + tickSize callback latency, as
+  seen by the IB reader thread
+- snapshot_ms_per_client: building the connect snapshots for all symbols
+- snapshot_ms_cached: the same for the next client in the frame, which gets
+  the cached payloads
+
+Socket.IO is replaced by a counter that JSON-encodes every payload once per
+connected client, the way a room broadcast does. Results are printed as JSON
+so they can be diffed between commits:
+
+    python benchmarks/hot_path.py --symbols 1 10 100 --clients 1 10 > bench.json 2>/dev/null
+    python benchmarks/hot_path.py --format binary ...
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ibapi.common import TickAttrib
+
+from ib import FakeTWS, SubscriptionRegistry, TWSConnection
+from log import Logger
+from market import TickStore
+from stream import FORMATS, Broadcaster
+
+
+def encoded_size(data):
+    """JSON size of a payload, with bytes values sent as binary attachments"""
+    if isinstance(data, dict) and any(isinstance(value, bytes) for value in data.values()):
+        attachments = sum(len(value) for value in data.values() if isinstance(value, bytes))
+        rest = {key: value for key, value in data.items() if not isinstance(value, bytes)}
+        return attachments + len(json.dumps(rest))
+    return len(json.dumps(data))
+
+
+class CountingSocketIO:
+    """Socket.IO stand-in that encodes each emit once per client and counts bytes
+
+    All benchmark clients share one wire format, so room emits go to every client.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.bytes = 0
+        self.emits = 0
+
+    def emit(self, event, data=None, **kwargs):
+        for _ in range(self.clients):
+            self.bytes += len(event) + encoded_size(data)
+        self.emits += 1
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def build(symbols, clients, root, fmt):
+    socketio = CountingSocketIO(clients)
+    logger = Logger('bench', socketio, queued=True)
+    subscriptions = SubscriptionRegistry()
+    tws = TWSConnection(logger, socketio, subscriptions, TickStore(os.path.join(root, 'ticks')))
+    FakeTWS().attach(tws)
+    tws.start_connect()
+    for i in range(symbols):
+        tws.request_market_data(f"S{i:04d}")
+    # The stand-in clients never ack, so flow control would only measure conflation
+    broadcaster = Broadcaster(socketio, subscriptions, max_inflight=None)
+    for subscription in subscriptions:
+        broadcaster.watch(f'bench-{subscription.symbol}', fmt, subscription.symbol)
+    broadcaster.start()
+    return socketio, tws, broadcaster
+
+
+def drive(tws, req_ids, prices, sizes, latencies=None):
+    attrib = TickAttrib()
+    n = len(req_ids)
+    for i in range(len(prices)):
+        req_id = req_ids[i % n]
+        start = time.perf_counter_ns()
+        tws.tickPrice(req_id, 4, prices[i], attrib)
+        tws.tickSize(req_id, 5, sizes[i])
+        if latencies is not None:
+            latencies[i] = time.perf_counter_ns() - start
+
+
+def run_case(symbols, clients, ticks, seed, fmt):
+    root = tempfile.mkdtemp(prefix='ib-flask-bench-')
+    os.chdir(root)  # Logger writes its file to the working directory
+    rng = np.random.default_rng(seed)
+    prices = (100 + np.cumsum(rng.normal(0, 0.02, ticks))).round(2).tolist()
+    sizes = (rng.integers(1, 6, ticks) * 100).tolist()
+
+    socketio, tws, broadcaster = build(symbols, clients, root, fmt)
+    req_ids = [subscription.req_id for subscription in tws.subscriptions]
+
+    # Timed pass
+    latencies = np.empty(ticks, dtype=np.int64)
+    wall, cpu = time.perf_counter(), time.process_time()
+    drive(tws, req_ids, prices, sizes, latencies)
+    tws.dispatcher.wait_idle()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    time.sleep(broadcaster.interval * 2)  # Let the last frame go out
+    emitted = socketio.bytes
+
+    # Connect snapshots for every symbol, built and then from the cache
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        for subscription in tws.subscriptions:
+            broadcaster.snapshot(subscription, fmt)
+        timings.append(time.perf_counter() - start)
+    snapshot, cached = timings
+
+    # Allocation pass, separate so tracing does not skew the timings
+    sample = min(ticks, 20_000)
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    before = tracemalloc.take_snapshot()
+    drive(tws, req_ids, prices[:sample], sizes[:sample])
+    tws.dispatcher.wait_idle()
+    after = tracemalloc.take_snapshot()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    broadcaster.stop()
+    tws.start_disconnect()
+
+    return {
+        'symbols': symbols,
+        'clients': clients,
+        'format': fmt,
+        'ticks': ticks,
+        'ticks_per_sec': ticks / wall,
+        'cpu_us_per_tick': cpu / ticks * 1e6,
+        'alloc_blocks_per_tick': blocks / sample,
+        'alloc_bytes_per_tick': allocated / sample,
+        'emit_bytes_per_tick': emitted / ticks,
+        'latency_p50_us': float(np.percentile(latencies, 50)) / 1e3,
+        'latency_p99_us': float(np.percentile(latencies, 99)) / 1e3,
+        'snapshot_ms_per_client': snapshot * 1e3,
+        'snapshot_ms_cached': cached * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--ticks', type=int, default=100_000, help='ticks per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=FORMATS, default='json', help='price wire format of the clients')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    results = {
+        'python': sys.version.split()[0],
+        'timestamp': time.time(),
+        'cases': [run_case(symbols, clients, args.ticks, args.seed, args.format)
+                  for symbols in args.symbols for clients in args.clients]
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,8 @@
-from .tws_connection import TWSConnection
\ No newline at end of file
+from .contracts import ContractResolver
+from .dispatcher import TickDispatcher
+from .fake_tws import FakeTWS
+from .pacing import RequestScheduler, TokenBucket
+from .subscriptions import (ACTIVE, CANCELLED, CANCELLING, ERROR, MODES, PENDING, SAMPLED, TICK_BY_TICK,
+                            Subscription, SubscriptionRegistry, stock_contract)
+from .supervisor import ConnectionSupervisor
+from .tws_connection import TWSConnection
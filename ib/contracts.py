@@ -0,0 +1,216 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+from .pacing import REQUEST
+from .subscriptions import stock_contract
+
+LOOKUPS = REGISTRY.counter('contract_lookups_total', 'Contract lookups by where they were answered', ['source'])
+
+# TWS has no contract matching the request
+NO_SECURITY_DEFINITION = 200
+
+# Preferred primary exchanges when a symbol resolves to several stocks
+PRIMARY_EXCHANGES = ('NASDAQ', 'NYSE', 'ARCA', 'AMEX', 'BATS')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    symbol TEXT PRIMARY KEY,
+    con_id INTEGER NOT NULL,
+    sec_type TEXT NOT NULL,
+    primary_exchange TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    local_symbol TEXT NOT NULL,
+    long_name TEXT NOT NULL,
+    min_tick REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+COLUMNS = 'symbol, con_id, sec_type, primary_exchange, currency, local_symbol, long_name, min_tick, updated'
+
+
+def contract_from_row(row):
+    """SMART-routed contract pinned to its conId and primary exchange"""
+    contract = stock_contract(row[0], currency=row[4])
+    contract.conId = row[1]
+    contract.secType = row[2]
+    contract.primaryExchange = row[3]
+    contract.localSymbol = row[5]
+    return contract
+
+
+class ContractResolver:
+    """Resolves symbols to IB contracts with reqContractDetails, cached
+
+    Resolved contracts are kept in an in-memory LRU of ``capacity`` symbols
+    backed by a SQLite table at ``path`` (memory only when None), which is
+    read into the LRU at startup. Entries older than ``max_age`` seconds are
+    resolved again, but still used if TWS cannot be asked.
+
+    ``resolve_many`` sends the requests for all cache misses at once through
+    the connection's request scheduler and waits for the answers together,
+    so a watchlist costs one paced batch instead of a round trip per symbol.
+    The connection forwards ``contractDetails``/``contractDetailsEnd`` and
+    errors to ``on_details``/``on_end``/``on_error``.
+    """
+
+    def __init__(self, tws, logger, path=None, capacity=4096, max_age=7 * 86400, timeout=10):
+        self.tws = tws
+        self.logger = logger
+        self.capacity = capacity
+        self.max_age = max_age
+        self.timeout = timeout
+        self._rows = OrderedDict()  # symbol -> row, most recently used last
+        self._pending = {}  # reqId -> [details, done event, error code]
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(SCHEMA)
+            self._db.commit()
+            self.warm()
+
+    def warm(self, limit=None):
+        """Load the most recently resolved symbols from disk into the LRU"""
+        if self._db is None:
+            return 0
+        with self._lock:
+            rows = self._db.execute(f"SELECT {COLUMNS} FROM contracts ORDER BY updated DESC LIMIT ?",
+                                    (limit or self.capacity,)).fetchall()
+            for row in reversed(rows):
+                self._rows[row[0]] = row
+        self.logger.info(f"Loaded {len(rows)} cached contract(s)")
+        return len(rows)
+
+    def _cached_row(self, symbol):
+        with self._lock:
+            row = self._rows.get(symbol)
+            if row is not None:
+                self._rows.move_to_end(symbol)
+                LOOKUPS.labels('memory').inc()
+                return row
+            if self._db is None:
+                return None
+            row = self._db.execute(f"SELECT {COLUMNS} FROM contracts WHERE symbol = ?", (symbol,)).fetchone()
+            if row is not None:
+                self._remember(row)
+                LOOKUPS.labels('disk').inc()
+            return row
+
+    def _remember(self, row):
+        self._rows[row[0]] = row
+        self._rows.move_to_end(row[0])
+        while len(self._rows) > self.capacity:
+            self._rows.popitem(last=False)
+
+    def cached(self, symbol):
+        """The cached contract for a symbol if it is fresh, else None"""
+        row = self._cached_row(symbol)
+        if row is None or time.time() - row[8] > self.max_age:
+            return None
+        return contract_from_row(row)
+
+    def contract(self, symbol):
+        """Best known contract for a symbol without asking TWS"""
+        row = self._cached_row(symbol)
+        return contract_from_row(row) if row is not None else stock_contract(symbol)
+
+    def resolve(self, symbol, timeout=None):
+        return self.resolve_many([symbol], timeout).get(symbol)
+
+    def resolve_many(self, symbols, timeout=None):
+        """Resolve symbols, asking TWS only for the ones not cached
+
+        Returns {symbol: Contract, or None when TWS knows no such stock}.
+        Symbols still unanswered after ``timeout`` fall back to a stale cache
+        entry or are left out.
+        """
+        result = {}
+        requests = []
+        for symbol in dict.fromkeys(symbols):
+            contract = self.cached(symbol)
+            if contract is not None:
+                result[symbol] = contract
+                continue
+            request_id = self.tws.next_request_id()
+            self._pending[request_id] = [[], threading.Event(), None]
+            requests.append((symbol, request_id))
+
+        if requests and self.tws.connected:
+            calls = [(self.tws.reqContractDetails, (request_id, stock_contract(symbol)))
+                     for symbol, request_id in requests]
+            self.tws.scheduler.submit_many(REQUEST, calls)
+            self.logger.info(f"Resolving {len(requests)} contract(s)")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        rows = []
+        for symbol, request_id in requests:
+            done = self._pending[request_id][1]
+            answered = self.tws.connected and done.wait(max(0.0, deadline - time.monotonic()))
+            details, done, error = self._pending.pop(request_id)
+            if not answered or error not in (None, NO_SECURITY_DEFINITION):
+                # Keep using what we had, however old
+                row = self._cached_row(symbol)
+                if row is not None:
+                    result[symbol] = contract_from_row(row)
+                continue
+
+            row = self._choose(symbol, details)
+            if row is None:
+                LOOKUPS.labels('unknown').inc()
+                self.logger.error(f"No stock contract found for {symbol}")
+                result[symbol] = None
+                continue
+            LOOKUPS.labels('tws').inc()
+            rows.append(row)
+            result[symbol] = contract_from_row(row)
+
+        if rows:
+            self._store(rows)
+        return result
+
+    def _choose(self, symbol, details):
+        """Pick one contract out of the details TWS returned for a symbol"""
+        if not details:
+            return None
+        if len(details) > 1:
+            self.logger.info(f"{symbol} is ambiguous ({len(details)} contracts), choosing by primary exchange")
+
+        def rank(detail):
+            exchange = detail.contract.primaryExchange
+            return PRIMARY_EXCHANGES.index(exchange) if exchange in PRIMARY_EXCHANGES else len(PRIMARY_EXCHANGES)
+
+        detail = min(details, key=rank)
+        contract = detail.contract
+        return (symbol, contract.conId, contract.secType or 'STK', contract.primaryExchange or '',
+                contract.currency or 'USD', contract.localSymbol or '', detail.longName or '',
+                float(detail.minTick or 0.0), time.time())
+
+    def _store(self, rows):
+        with self._lock:
+            for row in rows:
+                self._remember(row)
+            if self._db is not None:
+                self._db.executemany(f"INSERT OR REPLACE INTO contracts ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     rows)
+                self._db.commit()
+
+    # Forwarded EWrapper callbacks
+
+    def on_details(self, req_id, details):
+        request = self._pending.get(req_id)
+        if request is not None:
+            request[0].append(details)
+
+    def on_end(self, req_id):
+        request = self._pending.get(req_id)
+        if request is not None:
+            request[1].set()
+
+    def on_error(self, req_id, error_code):
+        request = self._pending.get(req_id)
+        if request is not None:
+            request[2] = error_code
+            request[1].set()
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+# Record kinds pushed by the IB callbacks
+PRICE = 0
+SIZE = 1
+TRADE = 2  # value is (price, size)
+QUOTE = 3  # value is (bid, ask, bid size, ask size)
+
+POLICIES = ('drop_newest', 'drop_oldest', 'conflate')
+
+DROPPED = REGISTRY.counter('dispatch_dropped_total', 'Tick records dropped because a shard was full', ['shard'])
+CONFLATED = REGISTRY.counter('dispatch_conflated_total', 'Tick records replaced by a newer one for the same key',
+                             ['shard'])
+PROCESSED = REGISTRY.counter('dispatch_processed_total', 'Tick records processed', ['shard'])
+BATCH_SECONDS = REGISTRY.histogram('dispatch_batch_seconds', 'Time spent processing one batch of records')
+
+
+class _Shard:
+    def __init__(self, index):
+        self.index = index
+        self.records = deque()
+        # reqId -> newest records in submission order, used by the conflate policy when full
+        self.conflated = {}
+        # Guards handing records between records and conflated
+        self.lock = threading.Lock()
+        self.idle = False
+        self.wakeup = threading.Event()
+        self.dropped = DROPPED.labels(str(index))
+        self.conflated_count = CONFLATED.labels(str(index))
+        self.processed = PROCESSED.labels(str(index))
+
+
+class TickDispatcher:
+    """Bounded hand-off between the IB reader thread and tick processing
+
+    The EWrapper callbacks only ``submit`` compact ``(kind, reqId, value, ts)``
+    tuples; one worker thread per shard drains them in batches and calls
+    ``handler(batch)``. Records are sharded by subscription, so each symbol
+    is processed in order by a single worker. A shard holds at most ``capacity`` records; when it
+    is full the ``policy`` decides what gives:
+
+    - ``drop_newest``: the incoming record is discarded
+    - ``drop_oldest``: the oldest queued record is discarded
+    - ``conflate``: only the newest record of each kind per reqId is kept
+      until the shard drains. A LAST price drops the size of the price it
+      replaces, so a size always follows the price it belongs to. Once
+      records are conflated, everything after them is conflated too until
+      the worker picks them up, so a symbol's records never overtake each
+      other.
+
+    Submitting takes no lock while the shard has room: deque operations are
+    atomic and the worker is only woken up through its event when it went
+    idle.
+    """
+
+    def __init__(self, handler, logger, shards=1, capacity=100_000, policy='drop_oldest', idle_wait=0.01):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown dispatch policy {policy}, use one of {POLICIES}")
+        self.handler = handler
+        self.logger = logger
+        self.capacity = capacity
+        self.policy = policy
+        self.idle_wait = idle_wait
+        self.shards = [_Shard(i) for i in range(shards)]
+        for shard in self.shards:
+            threading.Thread(target=self._worker, args=(shard,), daemon=True).start()
+        REGISTRY.gauge('dispatch_queue_depth', 'Tick records waiting per shard', ['shard'],
+                       callback=lambda: {(str(s.index),): len(s.records) for s in self.shards})
+
+    def submit(self, kind, req_id, value, ts, shard_key=None):
+        """Queue a record; ``shard_key`` defaults to the reqId, streams of one symbol must share it"""
+        shard = self.shards[(req_id if shard_key is None else shard_key) % len(self.shards)]
+        records = shard.records
+        if len(records) >= self.capacity or shard.conflated:
+            if self.policy == 'drop_newest':
+                shard.dropped.inc()
+                return
+            if self.policy == 'drop_oldest':
+                try:
+                    records.popleft()
+                except IndexError:
+                    pass
+                shard.dropped.inc()
+            elif self._conflate(shard, kind, req_id, value, ts):
+                if shard.idle:
+                    shard.wakeup.set()
+                return
+        records.append((kind, req_id, value, ts))
+        if shard.idle:
+            shard.wakeup.set()
+
+    def _conflate(self, shard, kind, req_id, value, ts):
+        """Keep a record in the conflated slot of its reqId; False if the shard has room again"""
+        with shard.lock:
+            if len(shard.records) < self.capacity and not shard.conflated:
+                return False
+            slot = shard.conflated.setdefault(req_id, [])
+            replaced = len(slot)
+            if kind == PRICE:
+                # The replaced price takes the size that followed it along; a size
+                # ahead of it belongs to a price that is still queued
+                for i, record in enumerate(slot):
+                    if record[0] == PRICE:
+                        end = i + 2 if slot[i + 1:i + 2] and slot[i + 1][0] == SIZE else i + 1
+                        del slot[i:end]
+                        break
+            elif kind == SIZE:
+                # A size after a size is a further trade at the same price
+                if slot and slot[-1][0] == SIZE:
+                    del slot[-1]
+            else:
+                slot[:] = [record for record in slot if record[0] != kind]
+            replaced -= len(slot)
+            slot.append((kind, req_id, value, ts))
+        if replaced:
+            shard.conflated_count.inc(replaced)
+        return True
+
+    def pending(self):
+        return sum(len(shard.records) + len(shard.conflated) for shard in self.shards)
+
+    def wait_idle(self, timeout=10.0):
+        """Block until every queued record was processed (for tests and benchmarks)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.pending() and all(shard.idle for shard in self.shards):
+                return True
+            time.sleep(0.001)
+        return False
+
+    def _worker(self, shard):
+        records = shard.records
+        while True:
+            if not records and not shard.conflated:
+                shard.idle = True
+                shard.wakeup.clear()
+                # Re-check after announcing idleness so no wake-up is missed
+                if not records and not shard.conflated:
+                    shard.wakeup.wait(self.idle_wait)
+                shard.idle = False
+                continue
+
+            if shard.conflated:
+                # Nothing gets queued while records are conflated, so under the lock
+                # the queue holds exactly the records submitted before them
+                with shard.lock:
+                    batch = [records.popleft() for _ in range(len(records))]
+                    conflated, shard.conflated = shard.conflated, {}
+                for slot in conflated.values():
+                    batch.extend(slot)
+            else:
+                batch = [records.popleft() for _ in range(len(records))]
+
+            start = time.perf_counter()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                self.logger.error(f"Tick dispatch handler failed: {str(e)}")
+            shard.processed.inc(len(batch))
+            BATCH_SECONDS.observe(time.perf_counter() - start)
@@ -0,0 +1,242 @@
+import heapq
+import itertools
+import random
+import time
+import zlib
+from collections import deque
+
+from ibapi.common import TickAttrib, TickAttribBidAsk, TickAttribLast
+from ibapi.contract import ContractDetails
+
+
+class FakeTWS:
+    """Deterministic stand-in for TWS / IB Gateway
+
+    ``attach`` swaps the socket-facing EClient calls of a TWSConnection for
+    local ones, so ``start_connect`` "connects" without a gateway and the
+    market data requests are answered by calling the connection's own EWrapper
+    callbacks (``tickPrice``/``tickSize``) from the API thread, exactly where
+    the EReader would call them.
+
+    Ticks are either a seeded random walk per symbol (``rate`` trades per
+    second per symbol) or recorded ticks from a TickStore (see ``replay``).
+    ``speed`` scales time, e.g. 10 or 100 times real time; ``speed=None``
+    sends as fast as the callbacks can take them. ``drop`` simulates a
+    gateway restart to exercise reconnects.
+    """
+
+    def __init__(self, rate=10.0, speed=1.0, seed=0, start_price=100.0):
+        self.rate = rate
+        self.speed = speed
+        self.seed = seed
+        self.start_price = start_price
+        self.tws = None
+        self.running = False
+        self.ticks_sent = 0
+        self._streams = {}  # reqId -> generator of (delay, price, size)
+        self._added = deque()  # (reqId, stream) not yet scheduled by run
+        self._recorded = None  # symbol -> structured tick array
+        self._walks = {}  # symbol -> random walk, continued across resubscribes
+        self._symbols = {}  # market data reqId -> symbol
+        self._tick_by_tick = set()  # reqIds streaming AllLast instead of tickPrice/tickSize
+        self._quotes = {}  # symbol -> BidAsk reqId
+        self._depth = {}  # symbol -> (depth reqId, rows, rng)
+        self._down_until = 0.0
+        self._dropped = False
+
+    def attach(self, tws):
+        """Route a TWSConnection's outbound calls to this stand-in"""
+        self.tws = tws
+        tws.connect = self.connect
+        tws.run = self.run
+        tws.disconnect = self.disconnect
+        tws.isConnected = lambda: self.running
+        tws.reqMktData = self.reqMktData
+        tws.cancelMktData = self.cancelMktData
+        tws.reqHistoricalData = self.reqHistoricalData
+        tws.cancelHistoricalData = lambda reqId: None
+        tws.reqHistoricalTicks = self.reqHistoricalTicks
+        tws.reqContractDetails = self.reqContractDetails
+        tws.reqTickByTickData = self.reqTickByTickData
+        tws.cancelTickByTickData = self.cancelTickByTickData
+        tws.reqMktDepth = self.reqMktDepth
+        tws.cancelMktDepth = self.cancelMktDepth
+        return self
+
+    def replay(self, ticks_by_symbol):
+        """Replay recorded ticks ({symbol: TICK_DTYPE array}) instead of a random walk"""
+        self._recorded = ticks_by_symbol
+        return self
+
+    def drop(self, downtime=0.0):
+        """Close the connection as a restarting gateway would, refusing connects for ``downtime`` seconds"""
+        self._down_until = time.monotonic() + downtime
+        self._dropped = True
+        self.running = False
+
+    # EClient stand-ins
+
+    def connect(self, host, port, client_id):
+        if time.monotonic() < self._down_until:
+            # Same callbacks as EClient.connect on a refused socket
+            self.tws.error(-1, 502, "Couldn't connect to TWS")
+            self.tws.connectionClosed()
+            return
+        self.running = True
+        self.tws.connectAck()
+
+    def disconnect(self):
+        if self.running:
+            self.running = False
+            self.tws.connectionClosed()
+
+    def reqMktData(self, reqId, contract, genericTickList, snapshot, regulatorySnapshot, mktDataOptions):
+        stream = self._stream(contract.symbol)
+        self._streams[reqId] = stream
+        self._symbols[reqId] = contract.symbol
+        self._added.append((reqId, stream))
+        self.tws.tickReqParams(reqId, 0.01, "", 0)
+
+    def cancelMktData(self, reqId):
+        self._streams.pop(reqId, None)
+
+    def reqTickByTickData(self, reqId, contract, tickType, numberOfTicks, ignoreSize):
+        if tickType == 'BidAsk':
+            # Quotes are sent around the symbol's trades
+            self._quotes[contract.symbol] = reqId
+            return
+        self._tick_by_tick.add(reqId)
+        self.reqMktData(reqId, contract, "", False, False, [])
+
+    def cancelTickByTickData(self, reqId):
+        self._tick_by_tick.discard(reqId)
+        self._quotes = {symbol: req for symbol, req in self._quotes.items() if req != reqId}
+        self.cancelMktData(reqId)
+
+    def reqMktDepth(self, reqId, contract, numRows, isSmartDepth, mktDepthOptions):
+        # Rows are quoted around the symbol's trades, so depth needs its market data too
+        self._depth[contract.symbol] = (reqId, numRows, random.Random(self.seed ^ reqId))
+
+    def cancelMktDepth(self, reqId, isSmartDepth):
+        self._depth = {symbol: depth for symbol, depth in self._depth.items() if depth[0] != reqId}
+
+    def _quote_depth(self, symbol, price):
+        """Requote every row of both sides around a trade, as L2 updates"""
+        depth = self._depth.get(symbol)
+        if depth is None:
+            return
+        req_id, rows, rng = depth
+        for row in range(rows):
+            for side, sign in ((0, 1), (1, -1)):  # ask above, bid below
+                self.tws.updateMktDepthL2(req_id, row, 'SMART', 1, side, round(price + sign * 0.01 * (row + 1), 2),
+                                          rng.randint(1, 20) * 100, True)
+
+    def reqContractDetails(self, reqId, contract):
+        # Every symbol exists, on NASDAQ, with a conId derived from its name
+        details = ContractDetails()
+        details.contract.symbol = contract.symbol
+        details.contract.secType = contract.secType
+        details.contract.exchange = contract.exchange
+        details.contract.primaryExchange = 'NASDAQ'
+        details.contract.currency = contract.currency
+        details.contract.localSymbol = contract.symbol
+        details.contract.conId = zlib.crc32(contract.symbol.encode()) & 0x7fffffff
+        details.minTick = 0.01
+        self.tws.contractDetails(reqId, details)
+        self.tws.contractDetailsEnd(reqId)
+
+    def reqHistoricalTicks(self, reqId, contract, startDateTime, endDateTime, numberOfTicks, whatToShow, useRth,
+                           ignoreSize, miscOptions):
+        # No recorded gap offline; end the request right away
+        self.tws.historicalTicksLast(reqId, [], True)
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                          useRTH, formatDate, keepUpToDate, chartOptions):
+        # No history offline; end the request right away
+        self.tws.historicalDataEnd(reqId, "", "")
+
+    # Tick generation
+
+    def _stream(self, symbol):
+        if self._recorded is not None and symbol in self._recorded:
+            return self._recorded_stream(self._recorded[symbol])
+        if symbol not in self._walks:
+            self._walks[symbol] = self._random_walk(symbol)
+        # A fresh generator per request, so a cancelled one is told apart from its replacement
+        return (tick for tick in self._walks[symbol])
+
+    def _random_walk(self, symbol):
+        # Seeded per symbol so every run produces the same sequence
+        rng = random.Random(self.seed ^ zlib.crc32(symbol.encode()))
+        price = self.start_price
+        interval = 1.0 / self.rate
+        while True:
+            price = max(0.01, round(price + rng.gauss(0, 0.02), 2))
+            yield rng.expovariate(1.0 / interval), price, rng.randint(1, 5) * 100
+
+    def _recorded_stream(self, ticks):
+        previous = int(ticks['ts'][0]) if len(ticks) else 0
+        for ts, price, size in zip(ticks['ts'].tolist(), ticks['price'].tolist(), ticks['size'].tolist()):
+            yield (ts - previous) / 1e9, price, size
+            previous = ts
+
+    def run(self):
+        """Deliver ticks until disconnected, on the caller's (API) thread"""
+        attrib = TickAttrib()
+        attrib_last = TickAttribLast()
+        attrib_bid_ask = TickAttribBidAsk()
+        heap = []  # (replay time, seq, reqId, stream, price, size)
+        sequence = itertools.count()
+        clock = 0.0  # replay time of the last delivered tick
+        start = time.monotonic()
+
+        def schedule(req_id, stream):
+            delay, price, size = next(stream, (None, None, None))
+            if delay is not None:
+                heapq.heappush(heap, (clock + delay, next(sequence), req_id, stream, price, size))
+
+        while self.running:
+            while self._added:
+                schedule(*self._added.popleft())
+            if not heap:
+                time.sleep(0.01)
+                continue
+
+            due, _, req_id, stream, price, size = heap[0]
+            if self.speed is not None:
+                wait = start + due / self.speed - time.monotonic()
+                if wait > 0:
+                    # Sleep in short slices so new subscriptions get scheduled
+                    time.sleep(min(wait, 0.01))
+                    continue
+
+            heapq.heappop(heap)
+            if self._streams.get(req_id) is not stream:
+                continue  # Cancelled
+
+            clock = due
+            symbol = self._symbols.get(req_id)
+            if req_id in self._tick_by_tick:
+                now = int(time.time())
+                self.tws.tickByTickAllLast(req_id, 2, now, price, size, attrib_last, 'NASDAQ', '')
+                quote_id = self._quotes.get(symbol)
+                if quote_id is not None:
+                    self.tws.tickByTickBidAsk(quote_id, now, round(price - 0.01, 2), round(price + 0.01, 2),
+                                              size, size, attrib_bid_ask)
+            else:
+                self.tws.tickPrice(req_id, 4, price, attrib)  # LAST
+                self.tws.tickSize(req_id, 5, size)  # LAST_SIZE
+            if self._depth:
+                self._quote_depth(symbol, price)
+            self.ticks_sent += 1
+            schedule(req_id, stream)
+
+        if self._dropped:
+            # The server forgets its subscriptions; EClient.run reports the close
+            self._dropped = False
+            self._streams.clear()
+            self._added.clear()
+            self._depth.clear()
+            self._tick_by_tick.clear()
+            self._quotes.clear()
+            self.tws.connectionClosed()
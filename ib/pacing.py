@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+# Priority classes, served in this order
+CANCEL = 0
+REQUEST = 1
+SUBSCRIBE = 2
+
+CLASS_NAMES = {CANCEL: 'cancel', REQUEST: 'request', SUBSCRIBE: 'subscribe'}
+
+# Historical requests wait in a queue of their own, served after the other
+# requests, so a drained historical bucket only holds up historical calls
+HISTORICAL = 'historical'
+QUEUE_ORDER = (CANCEL, REQUEST, HISTORICAL, SUBSCRIBE)
+QUEUE_NAMES = {**CLASS_NAMES, HISTORICAL: 'historical'}
+
+SENT = REGISTRY.counter('ib_requests_sent_total', 'Outbound IB API calls sent by the scheduler', ['class'])
+QUEUE_SECONDS = REGISTRY.histogram('ib_request_queue_seconds', 'Time outbound calls waited for pacing')
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``burst`` saved up"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def available(self, now):
+        """Whole tokens available now"""
+        self._refill(now)
+        return int(self.tokens)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RequestScheduler:
+    """Paces every outbound EClient call under IB's request limits
+
+    All calls share one token bucket (``rate`` messages per second, 50 by
+    default). On top of that historical data requests have their own, much
+    slower bucket, and new market data subscriptions only go out while fewer
+    than ``max_lines`` market data lines are in use. Cancels always go first,
+    then other requests, then new subscriptions, so a bulk subscribe runs at
+    the maximum legal rate without starving anything else. Historical
+    requests wait in their own queue, so while their bucket is empty other
+    requests still go out.
+    """
+
+    def __init__(self, logger, rate=50, max_lines=100, historical_rate=60 / 600, historical_burst=60):
+        self.logger = logger
+        self.messages = TokenBucket(rate, rate)
+        self.historical = TokenBucket(historical_rate, historical_burst)
+        self.max_lines = max_lines
+        self.lines_in_use = 0
+        self._queues = {queue: deque() for queue in QUEUE_ORDER}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+        REGISTRY.gauge('ib_market_data_lines', 'Market data lines in use', callback=lambda: self.lines_in_use)
+        REGISTRY.gauge('ib_request_queue_depth', 'Outbound calls waiting for pacing', ['class'],
+                       callback=lambda: {(QUEUE_NAMES[k],): len(q) for k, q in self._queues.items()})
+
+    def submit(self, priority, fn, *args, lines=0, historical=False):
+        """Queue ``fn(*args)``; ``lines`` is the change in market data lines it causes"""
+        self.submit_many(priority, [(fn, args)], lines=lines, historical=historical)
+
+    def submit_many(self, priority, calls, lines=0, historical=False):
+        """Queue a batch of ``(fn, args)`` calls of the same class with one wake-up"""
+        queued = time.monotonic()
+        with self._cond:
+            queue = self._queues[HISTORICAL if historical else priority]
+            queue.extend((priority, fn, args, lines, historical, queued) for fn, args in calls)
+            self._cond.notify()
+
+    def release_lines(self, count=1):
+        """Give back lines of subscriptions that TWS rejected or dropped"""
+        with self._cond:
+            self.lines_in_use = max(0, self.lines_in_use - count)
+            self._cond.notify()
+
+    def historical_available(self):
+        """Historical requests that could go out right away"""
+        with self._cond:
+            return max(0, self.historical.available(time.monotonic()) - len(self._queues[HISTORICAL]))
+
+    def discard(self, predicate):
+        """Drop the queued calls for which ``predicate(fn, args)`` is true; returns how many"""
+        with self._cond:
+            dropped = 0
+            for name, queue in self._queues.items():
+                kept = deque(call for call in queue if not predicate(call[1], call[2]))
+                dropped += len(queue) - len(kept)
+                self._queues[name] = kept
+            return dropped
+
+    def reset(self):
+        """Forget queued calls and lines in use, e.g. after a disconnect"""
+        with self._cond:
+            for queue in self._queues.values():
+                queue.clear()
+            self.lines_in_use = 0
+
+    def _next(self, now):
+        """Pick the next eligible call, or return the seconds to wait for one"""
+        wait = self.messages.wait_time(now)
+        if wait:
+            return None, wait
+
+        waits = []
+        for queue in (self._queues[name] for name in QUEUE_ORDER):
+            if not queue:
+                continue
+            priority, fn, args, lines, historical, queued = queue[0]
+            if historical:
+                historical_wait = self.historical.wait_time(now)
+                if historical_wait:
+                    waits.append(historical_wait)
+                    continue
+                self.historical.take()
+            if lines > 0 and self.lines_in_use + lines > self.max_lines:
+                continue  # Woken up again when a line is released
+            queue.popleft()
+            self.messages.take()
+            self.lines_in_use = max(0, self.lines_in_use + lines)
+            return (priority, fn, args, queued), 0.0
+        return None, min(waits) if waits else None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    call, wait = self._next(time.monotonic())
+                    if call is not None:
+                        break
+                    self._cond.wait(wait)
+
+            priority, fn, args, queued = call
+            QUEUE_SECONDS.observe(time.monotonic() - queued)
+            try:
+                fn(*args)
+            except Exception as e:
+                self.logger.error(f"Request {fn.__name__} failed: {str(e)}")
+            SENT.labels(CLASS_NAMES[priority]).inc()
@@ -0,0 +1,218 @@
+import threading
+from collections import OrderedDict
+
+from ibapi.contract import Contract
+
+from market import BarSet, SymbolAnalytics, TickRingBuffer
+
+
+def stock_contract(symbol, exchange="SMART", currency="USD"):
+    """Create a stock contract for a symbol"""
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = "STK"
+    contract.exchange = exchange
+    contract.currency = currency
+    return contract
+
+
+# Market data modes: IB's sampled tickPrice/tickSize feed, or every trade and quote
+SAMPLED = 'sampled'
+TICK_BY_TICK = 'tick_by_tick'
+MODES = (SAMPLED, TICK_BY_TICK)
+
+# Subscription states
+PENDING = 'pending'
+ACTIVE = 'active'
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+ERROR = 'error'
+
+TRANSITIONS = {
+    PENDING: {ACTIVE, CANCELLING, CANCELLED, ERROR},
+    ACTIVE: {PENDING, CANCELLING, CANCELLED, ERROR},  # Back to pending while resubscribing
+    CANCELLING: {CANCELLED, ERROR},
+    CANCELLED: set(),
+    ERROR: set(),
+}
+
+
+class Subscription:
+    """Market data subscription for a single symbol
+
+    Its ``state`` moves pending -> active -> cancelling -> cancelled, or to
+    error from any live state. ``streaming`` turns on with the first tick.
+    After a reconnect an active subscription goes back to pending.
+
+    In ``TICK_BY_TICK`` mode trades arrive on ``req_id`` (AllLast) and
+    quotes on ``quote_req_id`` (BidAsk).
+    """
+
+    def __init__(self, req_id, symbol, contract, capacity=100_000, max_bars=1000, mode=SAMPLED):
+        self.req_id = req_id
+        self.symbol = symbol
+        self.contract = contract
+        self.mode = mode
+        self.quote_req_id = None
+        self.requested = False  # Set once the request went out to TWS
+        self.quote_requested = False  # Same for the tick-by-tick BidAsk stream
+        self.state = PENDING
+        self.message = ''
+        self.streaming = False
+        self.ticks = TickRingBuffer(capacity)
+        self.analytics = SymbolAnalytics()
+        self.bars = BarSet(max_bars=max_bars)
+        self._awaiting_size = False
+
+    def transition(self, state, message=''):
+        """Move to ``state`` if allowed from the current one; returns whether it moved"""
+        if state not in TRANSITIONS[self.state]:
+            return False
+        self.state = state
+        self.message = message
+        return True
+
+    def status(self):
+        return {
+            'reqId': self.req_id,
+            'symbol': self.symbol,
+            'state': self.state,
+            'mode': self.mode,
+            'streaming': self.streaming,
+            'message': self.message
+        }
+
+    def on_last_price(self, ts, price):
+        self.ticks.append(ts, price)
+        self.analytics.update_price(price)
+        self.bars.update(ts, price)
+        self._awaiting_size = True
+
+    def on_last_size(self, ts, size):
+        """Attach a LAST_SIZE tick to its trade
+
+        The decoder follows every LAST price with its size; a size arriving on
+        its own is another trade at the unchanged price. Returns the completed
+        trade as (ts, price, size), or None.
+        """
+        if self._awaiting_size:
+            self.ticks.set_last_size(size)
+            self.bars.add_volume(size)
+            self._awaiting_size = False
+        else:
+            last = self.ticks.last()
+            if last is None:
+                return None
+            self.ticks.append(ts, last[1], size)
+            self.bars.update(ts, last[1], size)
+        self.analytics.update_trade(self.analytics.last_price, size)
+        return self.ticks.last()
+
+    def on_trade(self, ts, price, size):
+        """Apply a tick-by-tick trade, which carries price and size together"""
+        self._awaiting_size = False
+        self.ticks.append(ts, price, size)
+        self.analytics.update_price(price)
+        self.analytics.update_trade(price, size)
+        self.bars.update(ts, price, size)
+        return ts, price, size
+
+    def on_quote(self, bid, ask, bid_size, ask_size):
+        self.analytics.update_quote(bid, ask, bid_size, ask_size)
+
+
+class SubscriptionRegistry:
+    """Maps IB request ids to symbol subscriptions
+
+    Lookups by reqId are plain dict reads so the IB reader thread never takes
+    the lock; only adding and removing subscriptions is serialized. Removed
+    subscriptions are remembered for a while so their final state can still
+    be looked up by reqId.
+    """
+
+    RETIRED = 1000
+
+    def __init__(self, capacity=100_000, max_bars=1000):
+        self.capacity = capacity
+        self.max_bars = max_bars
+        self._by_req_id = {}
+        self._by_symbol = {}
+        self._retired = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, req_id, symbol, contract, mode=SAMPLED):
+        with self._lock:
+            return self._add(req_id, symbol, contract, mode)
+
+    def get_or_add(self, symbol, new_id, contract, mode=SAMPLED):
+        """Return (subscription, created) for a symbol, adding it if there is none
+
+        The lookup and the insert happen under one lock, so concurrent
+        subscribes to a symbol share one subscription. ``new_id()`` supplies
+        the request id(s) of a new one.
+        """
+        with self._lock:
+            subscription = self._by_symbol.get(symbol)
+            if subscription is not None:
+                return subscription, False
+            subscription = self._add(new_id(), symbol, contract, mode)
+            if mode == TICK_BY_TICK:
+                subscription.quote_req_id = new_id()
+                self._by_req_id[subscription.quote_req_id] = subscription
+            return subscription, True
+
+    def _add(self, req_id, symbol, contract, mode):
+        subscription = Subscription(req_id, symbol, contract, self.capacity, self.max_bars, mode)
+        self._by_req_id[req_id] = subscription
+        self._by_symbol[symbol] = subscription
+        return subscription
+
+    def add_quote_id(self, subscription, req_id):
+        """Route a second request id, the tick-by-tick BidAsk stream, to a subscription"""
+        with self._lock:
+            subscription.quote_req_id = req_id
+            self._by_req_id[req_id] = subscription
+
+    def remove(self, req_id):
+        with self._lock:
+            subscription = self._by_req_id.pop(req_id, None)
+            if subscription is not None:
+                # Either id removes both streams
+                self._by_req_id.pop(subscription.req_id, None)
+                self._by_req_id.pop(subscription.quote_req_id, None)
+                if self._by_symbol.get(subscription.symbol) is subscription:
+                    del self._by_symbol[subscription.symbol]
+                self._retired[req_id] = subscription
+                if len(self._retired) > self.RETIRED:
+                    self._retired.popitem(last=False)
+            return subscription
+
+    def lookup(self, req_id):
+        """Find a live or recently removed subscription"""
+        subscription = self._by_req_id.get(req_id)
+        return subscription if subscription is not None else self._retired.get(req_id)
+
+    def retired(self, state=CANCELLING):
+        """Removed subscriptions that are still in ``state``"""
+        return [s for s in list(self._retired.values()) if s.state == state]
+
+    def clear(self):
+        with self._lock:
+            self._by_req_id.clear()
+            self._by_symbol.clear()
+
+    def get(self, req_id):
+        return self._by_req_id.get(req_id)
+
+    def by_symbol(self, symbol):
+        return self._by_symbol.get(symbol)
+
+    def symbols(self):
+        return list(self._by_symbol)
+
+    def __iter__(self):
+        # One entry per symbol; _by_req_id also holds quote ids
+        return iter(list(self._by_symbol.values()))
+
+    def __len__(self):
+        return len(self._by_symbol)
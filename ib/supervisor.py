@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+
+from metrics import REGISTRY
+
+RECONNECTS = REGISTRY.counter('ib_reconnects_total', 'Reconnect attempts after TWS dropped the connection')
+RECOVERY_SECONDS = REGISTRY.histogram('ib_recovery_seconds',
+                                      'Time from losing the connection to resubscribing every symbol',
+                                      buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+
+class ConnectionSupervisor:
+    """Brings a TWSConnection back after TWS or IB Gateway drops it
+
+    ``connection_lost`` starts a background thread that reconnects with
+    exponential backoff (``delay`` doubling up to ``max_delay``, each wait
+    randomized by +/- ``jitter``) so clients of a restarted gateway do not all
+    retry in lockstep. Once connected it hands over to
+    ``TWSConnection.restore_subscriptions``, which backfills the gap and
+    replays every subscription in one paced batch.
+    """
+
+    def __init__(self, tws, logger, delay=1.0, max_delay=60.0, jitter=0.5):
+        self.tws = tws
+        self.logger = logger
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def connection_lost(self):
+        """Start reconnecting unless already doing so"""
+        self._start(self._reconnect)
+
+    def connection_restored(self):
+        """TWS kept the socket but lost the market data farms; resubscribe only"""
+        self._start(self._restore, time.monotonic())
+
+    def stop(self):
+        """Give up reconnecting, e.g. on an explicit disconnect"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    def _start(self, target, *args):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=target, args=args, daemon=True)
+            self._thread.start()
+
+    def backoff(self, attempt):
+        """Seconds to wait before reconnect attempt ``attempt`` (0-based)"""
+        delay = min(self.max_delay, self.delay * 2 ** attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _reconnect(self):
+        lost = time.monotonic()
+        self.attempts = 0
+        while not self._stop.is_set():
+            wait = self.backoff(self.attempts)
+            self.logger.info(f"Reconnecting to TWS in {wait:.1f}s (attempt {self.attempts + 1})")
+            if self._stop.wait(wait):
+                return
+            self.attempts += 1
+            RECONNECTS.inc()
+            if self.tws.reconnect():
+                break
+        else:
+            return
+
+        self.logger.info(f"Reconnected to TWS after {self.attempts} attempt(s)")
+        self._restore(lost)
+
+    def _restore(self, lost):
+        try:
+            self.tws.restore_subscriptions()
+        except Exception as e:
+            self.logger.error(f"Restoring subscriptions failed: {e}")
+            return
+        RECOVERY_SECONDS.observe(time.monotonic() - lost)
@@ -1,45 +1,120 @@
-from datetime import datetime
-from ibapi.contract import Contract
 from ibapi.utils import iswrapper
 
 # from .ib_wrapper import IBWrapper
 # from .ib_client import IBClient
+import itertools
+from collections import Counter
 import threading
 import time
 
+import pandas as pd
+
+from market import OrderBook
+
 # IB API imports
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.ticktype import TickType, TickTypeEnum
 
-current_symbol = "AAPL"
+from metrics import REGISTRY
+from .contracts import ContractResolver
+from .dispatcher import PRICE, QUOTE, SIZE, TRADE, TickDispatcher
+from .pacing import CANCEL, REQUEST, SUBSCRIBE, RequestScheduler
+from .subscriptions import (ACTIVE, CANCELLED, CANCELLING, ERROR, MODES, PENDING, SAMPLED, TICK_BY_TICK,
+                            SubscriptionRegistry, stock_contract)
+from .supervisor import ConnectionSupervisor
+
+TICKS = REGISTRY.counter('ib_ticks_total', 'LAST price ticks received', ['symbol'])
+CALLBACK_SECONDS = REGISTRY.histogram('ib_callback_seconds', 'Time spent in IB API callbacks', ['callback'])
+TICK_PRICE_SECONDS = CALLBACK_SECONDS.labels('tickPrice')
+TICK_SIZE_SECONDS = CALLBACK_SECONDS.labels('tickSize')
+TRADE_SECONDS = CALLBACK_SECONDS.labels('tickByTickAllLast')
+QUOTE_SECONDS = CALLBACK_SECONDS.labels('tickByTickBidAsk')
+DEPTH_SECONDS = CALLBACK_SECONDS.labels('updateMktDepth')
+DEPTH_UPDATES = REGISTRY.counter('ib_depth_updates_total', 'Market depth rows applied', ['symbol'])
+
+# Errors after which TWS will not send data for a market data request
+MARKET_DATA_ERRORS = {101, 200, 354, 10089, 10090, 10168, 10197}
+# Errors after which TWS will not send depth for a reqMktDepth
+DEPTH_ERRORS = MARKET_DATA_ERRORS | {309, 310, 10092}
+# TWS restarts the depth stream; rows arrive again from scratch
+DEPTH_RESET = 317
+# TWS reconnected to IB but its market data subscriptions are gone
+DATA_LOST = 1101
+# Ticks asked for per symbol when backfilling a disconnect
+BACKFILL_TICKS = 1000
 
 
 class TWSConnection(EClient, EWrapper):
     """Manages TWS connection and data requests"""
 
-    def __init__(self, logger, log_messages, socketio, price_data):
+    def __init__(self, logger, socketio, subscriptions=None, tick_store=None,
+                 dispatch_shards=1, dispatch_capacity=100_000, dispatch_policy='drop_oldest',
+                 request_rate=50, max_market_data_lines=100, reconnect_delay=1.0, max_reconnect_delay=60.0,
+                 contract_cache=None, depth_rows=10):
         self.logger = logger
-        self.log_messages = log_messages
         EWrapper.__init__(self)
         EClient.__init__(self, self)
         self.connected = False
-        self.request_id = 0
+        self.request_ids = itertools.count(1)
         self.socketio = socketio
-        self.price_data = price_data
+        self.subscriptions = subscriptions if subscriptions is not None else SubscriptionRegistry()
+        self.tick_store = tick_store
+        self._historical = {}  # reqId -> (bars or ticks, done event, finished event)
+        self.depth_rows = depth_rows
+        self.books = {}  # reqId -> OrderBook
+        # Callbacks only enqueue ticks; dispatch workers do the processing
+        self.dispatcher = TickDispatcher(self.process_ticks, logger, dispatch_shards,
+                                         dispatch_capacity, dispatch_policy)
+        # Every outbound request goes through the pacing scheduler
+        self.scheduler = RequestScheduler(logger, request_rate, max_market_data_lines)
+        # Orders sending a queued subscription against cancelling it
+        self._subscription_lock = threading.Lock()
+        # Symbol -> contract resolution, cached in memory and in SQLite at contract_cache
+        self.contracts = ContractResolver(self, logger, contract_cache)
+        # Reconnects after TWS drops us, until start_disconnect
+        self.supervisor = ConnectionSupervisor(self, logger, reconnect_delay, max_reconnect_delay)
+        self.auto_reconnect = False
+        self._endpoint = None
+        self._ready = threading.Event()  # Set by connectAck
+
+    def start_connect(self, host='127.0.0.1', port=4002, client_id=1, timeout=10):
+        """Connect to TWS
+
+        Waits up to ``timeout`` seconds for connectAck and returns whether the
+        connection is up. From here on a dropped connection is re-established
+        by the supervisor.
+        """
+        self._endpoint = (host, port, client_id)
+        self.auto_reconnect = True
+        return self._open(timeout)
 
-    def start_connect(self, host='127.0.0.1', port=4002, client_id=1):
-        """Connect to TWS"""
+    def reconnect(self, timeout=10):
+        """One reconnect attempt to the last endpoint, called by the supervisor"""
+        if not self.auto_reconnect:
+            return False
+        return self._open(timeout)
+
+    def _open(self, timeout):
+        host, port, client_id = self._endpoint
         self.logger.info(f"Connecting to TWS at {host}:{port} ...")
+        self._ready.clear()
         try:
             self.connect(host, port, client_id)
-            # Start the socket in a separate thread
-            api_thread = threading.Thread(target=self.run_loop, daemon=True)
-            api_thread.start()
-
         except Exception as e:
             self.logger.error(f"Connection error: {str(e)}")
             return False
+        if not self.isConnected():
+            # connect() already reported the error and closed the socket
+            return False
+
+        # Start the socket in a separate thread
+        api_thread = threading.Thread(target=self.run_loop, daemon=True)
+        api_thread.start()
+        if not self._ready.wait(timeout):
+            self.logger.error("TWS did not acknowledge the connection")
+            return False
+        return True
 
     def run_loop(self):
         """Run the IB API message loop"""
@@ -47,21 +122,191 @@ class TWSConnection(EClient, EWrapper):
 
     def start_disconnect(self):
         """Disconnect from TWS"""
-        if self.connected:
+        # Stop the supervisor first so the close below is not treated as a drop
+        self.auto_reconnect = False
+        self.supervisor.stop()
+        if self.isConnected():
             self.disconnect()
-            self.connected = False
-            self.logger.info("Disconnected from TWS")
+        self.connected = False
+        for subscription in self.subscriptions:
+            self.set_subscription_state(subscription, CANCELLED, 'Disconnected')
+        self.subscriptions.clear()
+        self.books.clear()
+        self.reset_requests('Disconnected')
+        self.logger.info("Disconnected from TWS")
 
     @iswrapper
     def connectAck(self):
         self.connected = True
+        self._ready.set()
         self.logger.info("Connected to TWS")
-        self.socketio.emit('connection_status', {'status': 'connected'})
+        if self.socketio is not None:
+            self.socketio.emit('connection_status', {'status': 'connected'})
+
+    @iswrapper
+    def connectionClosed(self):
+        """The socket to TWS is gone, after disconnect() or because TWS dropped it"""
+        was_connected = self.connected
+        self.connected = False
+        # Queued requests and market data lines belonged to the old connection
+        self.reset_requests('Connection closed')
+        for request in list(self._historical.values()):
+            request[1].set()
+        if not self.auto_reconnect:
+            return
+
+        if was_connected:
+            self.logger.error("Connection to TWS lost")
+            for subscription in self.subscriptions:
+                self.mark_resubscribing(subscription, 'Connection lost')
+        if self.socketio is not None:
+            self.socketio.emit('connection_status', {'status': 'reconnecting'})
+        self.supervisor.connection_lost()
+
+    def reset_requests(self, message):
+        """Drop every queued request; queued cancels are moot, their streams died with the connection"""
+        self.scheduler.reset()
+        for subscription in self.subscriptions.retired():
+            self.set_subscription_state(subscription, CANCELLED, message)
+
+    def mark_resubscribing(self, subscription, message):
+        """Put a subscription back to pending until it is requested again"""
+        subscription.requested = False
+        subscription.quote_requested = False
+        subscription.streaming = False
+        self.set_subscription_state(subscription, PENDING, message)
+
+    def restore_subscriptions(self):
+        """Backfill the gap and replay every subscription after a reconnect"""
+        subscriptions = list(self.subscriptions)
+        if subscriptions:
+            self.backfill(subscriptions)
+        self.logger.info(f"Resubscribing {len(subscriptions)} symbol(s)")
+        self.queue_market_data(subscriptions)
+        for book in list(self.books.values()):
+            book.clear()
+            self.send_depth_request(book)
+
+    def backfill(self, subscriptions, timeout=30):
+        """Fill the ticks missed while disconnected with reqHistoricalTicks
+
+        Runs before the symbols are resubscribed so the ring buffers stay in
+        time order. Only as many symbols as the historical bucket can take
+        right now are backfilled, so resubscribing never waits on historical
+        pacing; whatever arrived by ``timeout`` is applied and requests still
+        queued then are dropped.
+        """
+        # Let the workers finish ticks from before the drop
+        self.dispatcher.wait_idle(1.0)
+        candidates = [s for s in subscriptions if s.ticks.last() is not None]
+        budget = self.scheduler.historical_available()
+        if len(candidates) > budget:
+            self.logger.error(f"Historical pacing allows backfilling {budget} of {len(candidates)} symbol(s)")
+        requests = []
+        for subscription in candidates[:budget]:
+            last = subscription.ticks.last()
+            request_id = self.next_request_id()
+            ticks = []
+            done = threading.Event()
+            self._historical[request_id] = (ticks, done, threading.Event())
+            # yyyymmdd-hh:mm:ss is UTC
+            start = time.strftime('%Y%m%d-%H:%M:%S', time.gmtime(last[0] // 1_000_000_000))
+            self.scheduler.submit(REQUEST, self.reqHistoricalTicks, request_id, subscription.contract, start, "",
+                                  BACKFILL_TICKS, 'TRADES', 0, True, [], historical=True)
+            requests.append((subscription, request_id, ticks, done, last[0]))
+
+        deadline = time.monotonic() + timeout
+        for _, _, _, done, _ in requests:
+            done.wait(max(0.0, deadline - time.monotonic()))
+        pending = {request_id for _, request_id, _, done, _ in requests if not done.is_set()}
+        if pending:
+            # Unsent requests would only use up historical pacing for results nobody reads
+            self.scheduler.discard(lambda fn, args: fn == self.reqHistoricalTicks and args[0] in pending)
+
+        for subscription, request_id, ticks, done, last_ts in requests:
+            del self._historical[request_id]
+            count = self.apply_backfill(subscription, ticks, last_ts)
+            if count:
+                self.logger.info(f"Backfilled {count} tick(s) for {subscription.symbol}")
+
+    def apply_backfill(self, subscription, ticks, last_ts):
+        """Append historical ticks from the second of the last live tick on; returns how many
+
+        Historical ticks only carry whole seconds, so those in the same second
+        as the last live tick are matched against the live ticks of that
+        second by price and size, and only the ones not seen live are added.
+        """
+        last_second = last_ts // 1_000_000_000
+        ts_col, price_col, size_col = subscription.ticks.window(BACKFILL_TICKS)
+        same = ts_col // 1_000_000_000 == last_second
+        seen = Counter(zip(price_col[same].tolist(), size_col[same].tolist()))
+        count = 0
+        for tick in ticks:
+            if tick.time < last_second:
+                continue
+            if tick.time == last_second:
+                key = (float(tick.price), float(tick.size))
+                if seen[key]:
+                    seen[key] -= 1
+                    continue
+            # Never behind the last live tick, so the buffer stays in time order
+            ts = max(tick.time * 1_000_000_000, last_ts)
+            subscription.on_last_price(ts, tick.price)
+            trade = subscription.on_last_size(ts, tick.size)
+            if trade is not None and self.tick_store is not None:
+                self.tick_store.append(subscription.symbol, *trade)
+            count += 1
+        return count
 
     @iswrapper
     def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=""):
         """Handle errors from IB API"""
         self.logger.error(f"Error {errorCode}: {errorString}")
+        # Unblock a historical request that failed
+        request = self._historical.get(reqId)
+        if request is not None:
+            request[1].set()
+        self.contracts.on_error(reqId, errorCode)
+        if errorCode == DATA_LOST:
+            for subscription in self.subscriptions:
+                self.mark_resubscribing(subscription, errorString)
+            self.reset_requests(errorString)
+            self.supervisor.connection_restored()
+        elif errorCode == DEPTH_RESET and reqId in self.books:
+            self.books[reqId].clear()
+        elif errorCode in DEPTH_ERRORS and reqId in self.books:
+            book = self.books.pop(reqId)
+            self.logger.error(f"Market depth for {book.symbol} stopped")
+        # A rejected subscription does not hold a market data line
+        elif errorCode in MARKET_DATA_ERRORS:
+            subscription = self.subscriptions.remove(reqId)
+            if subscription is not None:
+                self.scheduler.release_lines()
+                if reqId == subscription.quote_req_id:
+                    subscription.quote_requested = False
+                    if subscription.requested:
+                        # The trade stream still holds its own line
+                        self.scheduler.submit(CANCEL, self.cancel_stream, subscription, subscription.mode, lines=-1)
+                else:
+                    for fn, args in self.quote_cancels(subscription, subscription.mode):
+                        self.scheduler.submit(CANCEL, fn, *args, lines=-1)
+                self.set_subscription_state(subscription, ERROR, f"Error {errorCode}: {errorString}")
+
+    def set_subscription_state(self, subscription, state, message=''):
+        """Apply a state transition and tell the clients about it"""
+        if not subscription.transition(state, message):
+            return False
+        self.logger.info(f"Subscription {subscription.req_id} for {subscription.symbol} is {state}")
+        if self.socketio is not None:
+            self.socketio.emit('subscription_status', subscription.status())
+        return True
+
+    @iswrapper
+    def tickReqParams(self, tickerId, minTick, bboExchange, snapshotPermissions):
+        """TWS accepted a market data request"""
+        subscription = self.subscriptions.get(tickerId)
+        if subscription is not None:
+            self.set_subscription_state(subscription, ACTIVE)
 
     # @iswrapper
     # def nextValidId(self, order_id: int):
@@ -69,61 +314,346 @@ class TWSConnection(EClient, EWrapper):
     #     self.request_id = order_id
 
     def next_request_id(self):
-        self.request_id += 1
-        return self.request_id
+        # itertools.count is atomic under the GIL, so Flask worker threads can share it
+        return next(self.request_ids)
 
     def request_market_data(self, symbol):
-        """Request real-time market data for a symbol"""
+        """Request real-time market data for a symbol
+
+        Adds the symbol to the set of active subscriptions; subscribing to a
+        symbol that is already active is a no-op.
+        """
+        return self.subscribe_many([symbol])
+
+    def subscribe_many(self, symbols, mode=SAMPLED):
+        """Subscribe a list of symbols in one paced batch
+
+        ``mode`` picks IB's sampled feed or tick-by-tick trades and quotes for
+        new subscriptions; symbols already subscribed keep theirs.
+
+        The requests are queued with the scheduler, which sends them at the
+        maximum rate IB allows and holds them while all market data lines are
+        in use. Symbols without a cached contract are resolved first, in the
+        background. Returns the subscription handles, whose state tracks the
+        request, or None when not connected.
+        """
         if not self.connected:
-            return False
+            return None
 
-        # Create contract
-        contract = Contract()
-        contract.symbol = symbol
-        contract.secType = "STK"
-        contract.exchange = "SMART"
-        contract.currency = "USD"
+        handles = []
+        ready = []
+        unresolved = []
+        for symbol in symbols:
+            contract = self.contracts.cached(symbol)
+            # Register before requesting so the first tick finds its subscription
+            subscription, created = self.subscriptions.get_or_add(symbol, self.next_request_id,
+                                                                  contract or stock_contract(symbol), mode)
+            if created:
+                (ready if contract is not None else unresolved).append(subscription)
+            handles.append(subscription)
 
-        # Request market data
-        request_id = self.next_request_id()
-        self.reqMktData(request_id, contract, "", False, False, [])
+        self.queue_market_data(ready)
+        if unresolved:
+            # Unknown symbols cost a reqContractDetails round trip; don't hold up the caller
+            threading.Thread(target=self.resolve_and_queue, args=(unresolved,), daemon=True).start()
+        return handles
+
+    def queue_market_data(self, subscriptions):
+        if subscriptions:
+            calls = [(self.send_market_data_request, (s.req_id,)) for s in subscriptions]
+            self.scheduler.submit_many(SUBSCRIBE, calls, lines=1)
+            self.logger.info(f"Requested market data for {len(calls)} symbol(s): "
+                             f"{', '.join(s.symbol for s in subscriptions)}")
+
+    def resolve_and_queue(self, subscriptions):
+        """Resolve the contracts of new subscriptions, then queue their requests"""
+        contracts = self.contracts.resolve_many([s.symbol for s in subscriptions])
+        ready = []
+        for subscription in subscriptions:
+            if subscription.symbol in contracts and contracts[subscription.symbol] is None:
+                if self.subscriptions.remove(subscription.req_id) is not None:
+                    self.set_subscription_state(subscription, ERROR, f"Unknown symbol {subscription.symbol}")
+                continue
+            # Unanswered lookups go out with the plain SMART contract
+            subscription.contract = contracts.get(subscription.symbol, subscription.contract)
+            ready.append(subscription)
+        self.queue_market_data(ready)
+
+    def send_market_data_request(self, req_id):
+        """Send a queued subscription, called by the scheduler"""
+        with self._subscription_lock:
+            subscription = self.subscriptions.get(req_id)
+            if subscription is not None:
+                subscription.requested = True
+        if subscription is None:
+            # Cancelled while it was waiting; it never used its line
+            self.scheduler.release_lines()
+            return
+        if subscription.mode == TICK_BY_TICK:
+            self.reqTickByTickData(req_id, subscription.contract, 'AllLast', 0, False)
+            # The BidAsk stream is a request of its own, with its own token and line
+            self.scheduler.submit(SUBSCRIBE, self.send_quote_request, req_id, lines=1)
+        else:
+            self.reqMktData(req_id, subscription.contract, "", False, False, [])
+
+    def send_quote_request(self, req_id):
+        """Send the BidAsk stream of a tick-by-tick subscription, called by the scheduler"""
+        with self._subscription_lock:
+            subscription = self.subscriptions.get(req_id)
+            live = subscription is not None and subscription.mode == TICK_BY_TICK and subscription.requested
+            if live:
+                subscription.quote_requested = True
+        if not live:
+            # Cancelled or switched back to sampled data while it was waiting
+            self.scheduler.release_lines()
+            return
+        self.reqTickByTickData(subscription.quote_req_id, subscription.contract, 'BidAsk', 0, True)
 
-        self.logger.info(f"Requested market data for {symbol}")
+    def cancel_stream(self, subscription, mode):
+        """Stop the trade or sampled TWS data stream a subscription has in ``mode``"""
+        if mode == TICK_BY_TICK:
+            self.cancelTickByTickData(subscription.req_id)
+        else:
+            self.cancelMktData(subscription.req_id)
+
+    def quote_cancels(self, subscription, mode):
+        """The paced BidAsk cancel a subscription needs on top of cancel_stream, if any"""
+        if mode != TICK_BY_TICK or not subscription.quote_requested:
+            return []
+        subscription.quote_requested = False
+        return [(self.cancelTickByTickData, (subscription.quote_req_id,))]
+
+    def set_market_data_mode(self, symbol, mode):
+        """Switch a subscription between sampled and tick-by-tick data
+
+        The subscription, and with it the tick history and analytics, stays;
+        only the TWS stream behind it is replaced.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown market data mode {mode}, use one of {MODES}")
+        subscription = self.subscriptions.by_symbol(symbol)
+        if subscription is None or subscription.mode == mode:
+            return subscription
+
+        with self._subscription_lock:
+            previous, subscription.mode = subscription.mode, mode
+            if mode == TICK_BY_TICK and subscription.quote_req_id is None:
+                self.subscriptions.add_quote_id(subscription, self.next_request_id())
+            requested = subscription.requested
+            cancels = self.quote_cancels(subscription, previous) + [(self.cancel_stream, (subscription, previous))]
+        if requested and self.connected:
+            # Each stream gives back its line; the new request takes lines again
+            self.scheduler.submit_many(CANCEL, cancels, lines=-1)
+            self.scheduler.submit(SUBSCRIBE, self.send_market_data_request, subscription.req_id, lines=1)
+        self.logger.info(f"Switched {symbol} to {mode} market data")
+        return subscription
+
+    def cancel_market_data(self, symbol):
+        """Cancel market data request for a symbol
+
+        Returns immediately; the subscription goes through cancelling and
+        becomes cancelled once the paced cancel was sent.
+        """
+        subscription = self.subscriptions.by_symbol(symbol)
+        if subscription is None:
+            return False
+
+        with self._subscription_lock:
+            self.subscriptions.remove(subscription.req_id)
+        # Only subscriptions that went out need a cancel
+        if self.connected and subscription.requested:
+            self.set_subscription_state(subscription, CANCELLING)
+            calls = self.quote_cancels(subscription, subscription.mode) + [(self.send_cancel_request, (subscription,))]
+            self.scheduler.submit_many(CANCEL, calls, lines=-1)
+        else:
+            self.set_subscription_state(subscription, CANCELLED)
         return True
 
-    def cancel_market_data(self, req_id=1):
-        """Cancel market data request"""
+    def send_cancel_request(self, subscription):
+        """Send a queued cancel, called by the scheduler"""
+        self.cancel_stream(subscription, subscription.mode)
+        self.set_subscription_state(subscription, CANCELLED)
+
+    def request_market_depth(self, symbol, rows=None):
+        """Start a level-2 order book for a symbol, returns the OrderBook
+
+        Uses SMART depth, which aggregates the exchanges TWS routes to.
+        """
+        if not self.connected:
+            return None
+        book = self.book(symbol)
+        if book is None:
+            book = OrderBook(symbol, self.next_request_id(), rows or self.depth_rows)
+            self.books[book.req_id] = book
+            self.send_depth_request(book)
+            self.logger.info(f"Requested {book.rows} rows of market depth for {symbol}")
+        return book
+
+    def send_depth_request(self, book):
+        self.scheduler.submit(REQUEST, self.reqMktDepth, book.req_id, self.contracts.contract(book.symbol),
+                              book.rows, True, [])
+
+    def cancel_market_depth(self, symbol):
+        book = self.book(symbol)
+        if book is None:
+            return False
+        del self.books[book.req_id]
         if self.connected:
-            self.cancelMktData(req_id)
-            self.logger.info(f"Cancelled market data request for {current_symbol}")
+            self.scheduler.submit(CANCEL, self.cancelMktDepth, book.req_id, True)
+        return True
+
+    def book(self, symbol):
+        for book in list(self.books.values()):
+            if book.symbol == symbol:
+                return book
+        return None
+
+    def fetch_historical_bars(self, symbol, bar_size, start, end, what_to_show='TRADES', timeout=60):
+        """Fetch bars for the dates [start, end] with reqHistoricalData
+
+        Blocks until historicalDataEnd (or ``timeout``) and returns a DataFrame
+        with time/open/high/low/close/volume columns. Its ``attrs['complete']``
+        is False when the request timed out or failed and the bars may stop
+        short of the range.
+        """
+        request_id = self.next_request_id()
+        bars = []
+        done = threading.Event()
+        finished = threading.Event()
+        self._historical[request_id] = (bars, done, finished)
+
+        days = (end - start).days + 1
+        # Durations over a year must be given in years
+        duration = f"{days} D" if days <= 365 else f"{-(-days // 365)} Y"
+        self.scheduler.submit(REQUEST, self.reqHistoricalData, request_id, self.contracts.contract(symbol),
+                              end.strftime('%Y%m%d 23:59:59'), duration, bar_size, what_to_show, 1, 1, False, [],
+                              historical=True)
+        self.logger.info(f"Requested {bar_size} bars for {symbol} from {start} to {end}")
+
+        if not done.wait(timeout):
+            self.scheduler.submit(CANCEL, self.cancelHistoricalData, request_id)
+            self.logger.error(f"Historical data request for {symbol} timed out")
+        del self._historical[request_id]
+
+        frame = pd.DataFrame([
+            (' '.join(bar.date.split()), bar.open, bar.high, bar.low, bar.close, bar.volume) for bar in bars
+        ], columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+        frame['time'] = pd.to_datetime(frame['time'], format='mixed')
+        frame.attrs['complete'] = finished.is_set()
+        return frame
+
+    @iswrapper
+    def historicalData(self, reqId, bar):
+        request = self._historical.get(reqId)
+        if request is not None:
+            request[0].append(bar)
+
+    @iswrapper
+    def historicalDataEnd(self, reqId, start, end):
+        request = self._historical.get(reqId)
+        if request is not None:
+            request[2].set()
+            request[1].set()
+
+    @iswrapper
+    def contractDetails(self, reqId, contractDetails):
+        self.contracts.on_details(reqId, contractDetails)
+
+    @iswrapper
+    def contractDetailsEnd(self, reqId):
+        self.contracts.on_end(reqId)
+
+    @iswrapper
+    def historicalTicksLast(self, reqId, ticks, done):
+        request = self._historical.get(reqId)
+        if request is not None:
+            request[0].extend(ticks)
+            if done:
+                request[2].set()
+                request[1].set()
 
     @iswrapper
     def tickPrice(self, reqId, tickType, price, attrib):
         """Handle real-time price updates"""
         # if TickTypeEnum(tickType) == TickTypeEnum.LAST:
         if tickType == 4: # TickTypeEnum.LAST
-            timestamp = datetime.now()
-            price_point = {
-                'timestamp': timestamp.strftime('%H:%M:%S'),
-                'price': price,
-                'datetime': timestamp.isoformat()
-            }
-            self.price_data.append(price_point)
-
-            # Emit real-time data to frontend
-            self.socketio.emit('price_update', {
-                'symbol': current_symbol,
-                'price': price,
-                'timestamp': price_point['timestamp'],
-                'data': list(self.price_data)[-50:]  # Send last 50 points
-            })
-
-            self.logger.info(f"Price update for {current_symbol}: ${price:.2f}")
+            start = time.perf_counter()
+            # Timestamps stay raw epoch-ns; formatting happens when a frame is serialized
+            self.dispatcher.submit(PRICE, reqId, price, time.time_ns())
+            TICK_PRICE_SECONDS.observe(time.perf_counter() - start)
 
     @iswrapper
     def tickSize(self, reqId, tickType, size):
         """Handle volume updates"""
+        if tickType == 5: # TickTypeEnum.LAST_SIZE
+            start = time.perf_counter()
+            self.dispatcher.submit(SIZE, reqId, size, time.time_ns())
+            TICK_SIZE_SECONDS.observe(time.perf_counter() - start)
         # if TickTypeEnum.  (tickType) == TickTypeEnum.VOLUME:
-        if tickType == 8: # TickTypeEnum.VOLUME
-            self.logger.info(f"Volume update: {size}")
+        elif tickType == 8: # TickTypeEnum.VOLUME
+            subscription = self.subscriptions.get(reqId)
+            if subscription is not None:
+                self.logger.info(f"Volume update for {subscription.symbol}: {size}")
+
+    @iswrapper
+    def tickByTickAllLast(self, reqId, tickType, tickTime, price, size, tickAttribLast, exchange, specialConditions):
+        """Handle every trade of a tick-by-tick subscription"""
+        start = time.perf_counter()
+        # Stamped on arrival like the sampled feed; IB's own time has only second resolution
+        self.dispatcher.submit(TRADE, reqId, (price, size), time.time_ns())
+        TRADE_SECONDS.observe(time.perf_counter() - start)
+
+    @iswrapper
+    def tickByTickBidAsk(self, reqId, tickTime, bidPrice, askPrice, bidSize, askSize, tickAttribBidAsk):
+        """Handle every top-of-book change of a tick-by-tick subscription"""
+        start = time.perf_counter()
+        # Quotes have their own reqId; shard them with the trades so one worker owns the symbol
+        subscription = self.subscriptions.get(reqId)
+        self.dispatcher.submit(QUOTE, reqId, (bidPrice, askPrice, bidSize, askSize), time.time_ns(),
+                               subscription.req_id if subscription is not None else None)
+        QUOTE_SECONDS.observe(time.perf_counter() - start)
+
+    @iswrapper
+    def updateMktDepth(self, reqId, position, operation, side, price, size):
+        """Handle order book rows; applied right here since dropping one would corrupt the book"""
+        self.updateMktDepthL2(reqId, position, '', operation, side, price, size, False)
+
+    @iswrapper
+    def updateMktDepthL2(self, reqId, position, marketMaker, operation, side, price, size, isSmartDepth=False):
+        start = time.perf_counter()
+        book = self.books.get(reqId)
+        if book is not None:
+            book.apply(position, operation, side, price, size, marketMaker)
+            DEPTH_UPDATES.labels(book.symbol).inc()
+        DEPTH_SECONDS.observe(time.perf_counter() - start)
+
+    def process_ticks(self, batch):
+        """Apply a batch of dispatched tick records, on a dispatch worker"""
+        for kind, reqId, value, ts in batch:
+            subscription = self.subscriptions.get(reqId)
+            if subscription is None:
+                continue
+
+            if not subscription.streaming and kind != SIZE:
+                # Tell clients once that data is flowing
+                subscription.streaming = True
+                if not self.set_subscription_state(subscription, ACTIVE) and self.socketio is not None:
+                    self.socketio.emit('subscription_status', subscription.status())
 
+            if kind == PRICE:
+                subscription.on_last_price(ts, value)
+                TICKS.labels(subscription.symbol).inc()
+                self.logger.info(f"Price update for {subscription.symbol}: ${value:.2f}")
+            elif kind == SIZE:
+                trade = subscription.on_last_size(ts, value)
+                # Persist completed trades; the store only enqueues here
+                if trade is not None and self.tick_store is not None:
+                    self.tick_store.append(subscription.symbol, *trade)
+            elif kind == TRADE:
+                # Too frequent to log one by one
+                trade = subscription.on_trade(ts, *value)
+                TICKS.labels(subscription.symbol).inc()
+                if self.tick_store is not None:
+                    self.tick_store.append(subscription.symbol, *trade)
+            else:
+                subscription.on_quote(*value)
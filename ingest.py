@@ -0,0 +1,26 @@
+"""
+Ingest process of the scale-out deployment
+
+Owns the TWS connection, the tick store and the broadcaster, exactly like
+``python app.py`` does, but serves no browsers: every Socket.IO event is
+published over a local Unix socket (BUS_PATH) to the web workers, which
+forward their HTTP requests and client joins back here.
+
+Run one ingest process and any number of workers on the same box:
+
+    python ingest.py
+    APP_MODE=web PORT=8001 python app.py
+    APP_MODE=web PORT=8002 python app.py
+
+Set BUS_REDIS_URL on all of them to fan the events out over Redis instead;
+requests still use the Unix socket.
+"""
+import os
+
+os.environ['APP_MODE'] = 'ingest'
+
+from app import bus, forget_worker, logger, serve_worker  # noqa: E402  (the mode is read on import)
+
+if __name__ == '__main__':
+    logger.info("Ingest process started")
+    bus.serve_forever(serve_worker, logger, on_close=forget_worker)
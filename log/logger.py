@@ -1,12 +1,26 @@
 import logging
+import queue
+import threading
 import time
 from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, BaseRotatingHandler
 from collections import deque
 
+from metrics import SOCKETIO_EMITS
+
+LOG_UPDATE_EMITS = SOCKETIO_EMITS.labels('log_update')
+LOG_APPEND_EMITS = SOCKETIO_EMITS.labels('log_append')
+
 class Logger(logging.Logger):
+    """Logger that mirrors its messages to the browser over Socket.IO
 
-    def __init__(self, name, socketio):
+    In queued mode ``info``/``error`` only enqueue the message. A background
+    writer drains the queue, writes each batch to the handlers in one go and
+    sends new lines to clients as ``log_append`` events at most once every
+    ``emit_interval`` seconds.
+    """
+
+    def __init__(self, name, socketio, queued=False, emit_interval=0.25, batch_size=1000):
         super().__init__(name)
         # self.logger = logging.getLogger(name)
         log_format = '%(message)s'
@@ -24,26 +38,114 @@ class Logger(logging.Logger):
         self.setLevel(logging.INFO)
 
         self.log_messages = deque(maxlen=100)  # Store last 100 log messages
+        self._version = 0  # bumped whenever log_messages changes
+        self._snapshot = (-1, [])
         self.socketio = socketio
+        self.lagging = None  # optional callable listing clients to leave out, they get a snapshot later
+
+        self.queued = queued
+        self.emit_interval = emit_interval
+        self.batch_size = batch_size
+        if queued:
+            self._queue = queue.SimpleQueue()
+            threading.Thread(target=self._writer, daemon=True).start()
 
     def info(self, msg, *args, **kwargs):
-        super().info(msg, args, kwargs)
-        self.log_messages.append({
-            'timestamp': datetime.now().strftime('%H:%M:%S'),
-            'level': 'INFO',
-            'message': f'{msg}'
-        })
-        self.socketio.emit('log_update', list(self.log_messages))
+        self._record(logging.INFO, msg, args, kwargs)
 
     def error(self, msg, *args, **kwargs):
-        super().info(msg)
-        self.log_messages.append({
-            'timestamp': datetime.now().strftime('%H:%M:%S'),
-            'level': 'ERROR',
-            'message': f'{msg}'
-        })
-        self.socketio.emit('log_update', list(self.log_messages))
+        self._record(logging.ERROR, msg, args, kwargs)
 
     def clear(self):
         self.log_messages.clear()
+        self._version += 1
+
+    def snapshot(self):
+        """The buffered messages as one shared list, rebuilt only after they changed"""
+        version, messages = self._snapshot
+        if version != self._version:
+            # Read the version first: a change racing with the copy only forces another rebuild
+            version = self._version
+            messages = list(self.log_messages)
+            self._snapshot = (version, messages)
+        return messages
+
+    def queue_depth(self):
+        """Messages waiting for the writer thread (0 when not queued)"""
+        return self._queue.qsize() if self.queued else 0
+
+    def _record(self, level, msg, args, kwargs):
+        if not self.isEnabledFor(level):
+            return
+        if self.queued:
+            # The only cost paid by the calling thread
+            self._queue.put((level, msg, args, time.time()))
+            return
+
+        super().log(level, msg, *args, **kwargs)
+        message = str(msg) % args if args else msg
+        self.log_messages.append(self._entry(level, message, time.time()))
+        self._version += 1
+        self.socketio.emit('log_update', self.snapshot())
+        LOG_UPDATE_EMITS.inc()
+
+    @staticmethod
+    def _entry(level, msg, created):
+        return {
+            'timestamp': datetime.fromtimestamp(created).strftime('%H:%M:%S'),
+            'level': logging.getLevelName(level),
+            'message': f'{msg}'
+        }
+
+    def _writer(self):
+        """Drain the queue, batch handler writes and rate-limit client updates"""
+        pending = []
+        next_emit = 0.0
+        while True:
+            timeout = max(0.0, next_emit - time.monotonic()) if pending else None
+            batch = self._drain(timeout)
+            if batch:
+                records = self._write(batch)
+                entries = [self._entry(r.levelno, r.getMessage(), r.created) for r in records]
+                self.log_messages.extend(entries)
+                self._version += 1
+                pending.extend(entries)
+
+            if pending and time.monotonic() >= next_emit:
+                # Clients only keep the last log_messages.maxlen lines anyway
+                skip = self.lagging() if self.lagging is not None else None
+                self.socketio.emit('log_append', pending[-self.log_messages.maxlen:], skip_sid=skip or None)
+                LOG_APPEND_EMITS.inc()
+                pending = []
+                next_emit = time.monotonic() + self.emit_interval
+
+    def _drain(self, timeout):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        records = []
+        for level, msg, args, created in batch:
+            record = self.makeRecord(self.name, level, '(queued)', 0, msg, args, None)
+            record.created = created
+            records.append(record)
 
+        for handler in self.handlers:
+            handler.acquire()
+            try:
+                if isinstance(handler, BaseRotatingHandler) and handler.shouldRollover(records[0]):
+                    handler.doRollover()
+                # One write and one flush per batch instead of per message
+                handler.stream.write(''.join(handler.format(r) + handler.terminator for r in records))
+                handler.flush()
+            except Exception:
+                handler.handleError(records[0])
+            finally:
+                handler.release()
+        return records
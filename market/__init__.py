@@ -0,0 +1,7 @@
+from .analytics import SymbolAnalytics
+from .bar_cache import HistoricalBarCache
+from .bars import BAR_SIZES, BarSet, BarSeries
+from .downsample import DOWNSAMPLE_METHODS, DownsampleCache, lttb, min_max
+from .order_book import OrderBook
+from .ring_buffer import TickRingBuffer, to_packed, to_points
+from .tick_store import TICK_DTYPE, TickStore
@@ -0,0 +1,189 @@
+import math
+from collections import deque
+
+
+class RollingStats:
+    """Mean and variance over the last ``window`` values with O(1) updates"""
+
+    # Running sums drift slowly; resum from the window now and then
+    RESUM_EVERY = 10_000
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._updates = 0
+
+    def update(self, value):
+        if len(self.values) == self.window:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+        self._updates += 1
+        if self._updates % self.RESUM_EVERY == 0:
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+
+    @property
+    def mean(self):
+        return self.total / len(self.values) if self.values else None
+
+    @property
+    def variance(self):
+        n = len(self.values)
+        if n < 2:
+            return None
+        mean = self.total / n
+        return max(self.total_sq / n - mean * mean, 0.0)
+
+    @property
+    def stdev(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+
+class Ema:
+    """Exponential moving average seeded with the first value"""
+
+    def __init__(self, period):
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class Vwap:
+    """Volume-weighted average price since the subscription started"""
+
+    def __init__(self):
+        self.notional = 0.0
+        self.volume = 0.0
+
+    def update(self, price, size):
+        if size > 0:
+            self.notional += price * size
+            self.volume += size
+
+    @property
+    def value(self):
+        return self.notional / self.volume if self.volume else None
+
+
+class Macd:
+    """MACD line, signal line and histogram"""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = Ema(fast)
+        self.slow = Ema(slow)
+        self.signal = Ema(signal)
+        self.macd = None
+
+    def update(self, value):
+        self.macd = self.fast.update(value) - self.slow.update(value)
+        self.signal.update(self.macd)
+
+    @property
+    def histogram(self):
+        return self.macd - self.signal.value if self.macd is not None else None
+
+
+class Rsi:
+    """Relative strength index with Wilder's smoothing"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.previous = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.count = 0
+
+    def update(self, value):
+        if self.previous is not None:
+            change = value - self.previous
+            gain = max(change, 0.0)
+            loss = max(-change, 0.0)
+            self.count += 1
+            # Plain average until the first period is filled, then Wilder smoothing
+            n = min(self.count, self.period)
+            self.avg_gain += (gain - self.avg_gain) / n
+            self.avg_loss += (loss - self.avg_loss) / n
+        self.previous = value
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        if self.avg_loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+
+
+class SymbolAnalytics:
+    """Incremental indicators for one symbol, updated once per tick
+
+    Computed on the server so every browser only renders the results.
+    """
+
+    def __init__(self, average_window=50, volatility_window=60, ema_period=20):
+        self.count = 0
+        self.first_price = None
+        self.last_price = None
+        self.average = RollingStats(average_window)
+        self.volatility = RollingStats(volatility_window)
+        self.ema = Ema(ema_period)
+        self.vwap = Vwap()
+        self.macd = Macd()
+        self.rsi = Rsi()
+        self.quote = None  # (bid, ask, bid size, ask size), tick-by-tick only
+
+    def update_price(self, price):
+        if self.first_price is None:
+            self.first_price = price
+        self.last_price = price
+        self.count += 1
+        self.average.update(price)
+        self.volatility.update(price)
+        self.ema.update(price)
+        self.macd.update(price)
+        self.rsi.update(price)
+
+    def update_trade(self, price, size):
+        self.vwap.update(price, size)
+
+    def update_quote(self, bid, ask, bid_size, ask_size):
+        self.quote = (bid, ask, bid_size, ask_size)
+
+    def snapshot(self):
+        """Return the current values, ready to be serialized"""
+        if self.last_price is None:
+            return None
+
+        stdev = self.volatility.stdev
+        mean = self.volatility.mean
+        bid, ask = self.quote[:2] if self.quote is not None else (None, None)
+        return {
+            'count': self.count,
+            'price': self.last_price,
+            'change': self.last_price - self.first_price,
+            'average': self.average.mean,
+            'volatility': stdev / mean * 100 if stdev is not None and mean else None,
+            'ema': self.ema.value,
+            'vwap': self.vwap.value,
+            'macd': self.macd.macd,
+            'macd_signal': self.macd.signal.value,
+            'macd_histogram': self.macd.histogram,
+            'rsi': self.rsi.value,
+            'bid': bid,
+            'ask': ask,
+            'spread': ask - bid if self.quote is not None else None
+        }
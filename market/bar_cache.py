@@ -0,0 +1,122 @@
+import json
+import os
+from datetime import date, timedelta
+
+import pandas as pd
+
+BAR_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+
+def missing_ranges(covered, start, end):
+    """Return the parts of [start, end] (inclusive dates) not in ``covered``"""
+    missing = []
+    cursor = start
+    for lo, hi in sorted(covered):
+        if hi < cursor:
+            continue
+        if lo > end:
+            break
+        if lo > cursor:
+            missing.append((cursor, lo - timedelta(days=1)))
+        cursor = max(cursor, hi + timedelta(days=1))
+    if cursor <= end:
+        missing.append((cursor, end))
+    return missing
+
+
+def merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class HistoricalBarCache:
+    """Local Parquet cache of historical bars, keyed by symbol and bar size
+
+    Each symbol/bar size pair is one Parquet file holding every bar fetched so
+    far, with the derived MACD columns already computed, plus a JSON sidecar
+    listing the date ranges it covers. ``get`` only calls ``fetch`` for the
+    dates that are not covered yet. Today is never marked as covered, since
+    its bars are still being formed.
+
+    ``fetch(symbol, bar_size, start, end)`` must return a DataFrame with the
+    ``BAR_COLUMNS`` columns; pass None to serve from the cache only. A frame
+    with ``attrs['complete']`` False (e.g. the request timed out) is kept,
+    but its range is fetched again next time.
+    """
+
+    def __init__(self, root, fetch=None, macd=(6, 12, 5)):
+        self.root = root
+        self.fetch = fetch
+        self.macd = macd
+
+    def _paths(self, symbol, bar_size):
+        base = os.path.join(self.root, f"{symbol}_{bar_size.replace(' ', '')}")
+        return base + '.parquet', base + '.json'
+
+    def _load(self, symbol, bar_size):
+        data_path, meta_path = self._paths(symbol, bar_size)
+        if not os.path.exists(data_path):
+            return pd.DataFrame(columns=BAR_COLUMNS), []
+        try:
+            with open(meta_path) as f:
+                covered = [(date.fromisoformat(lo), date.fromisoformat(hi)) for lo, hi in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            # No usable sidecar: keep the bars but fetch every range again
+            covered = []
+        return pd.read_parquet(data_path), covered
+
+    def _save(self, symbol, bar_size, df, covered):
+        """Replace both files atomically, bars first
+
+        An interrupted save leaves at worst the previous sidecar next to the
+        new bars; ranges only grow, so it just under-reports what is covered.
+        """
+        data_path, meta_path = self._paths(symbol, bar_size)
+        os.makedirs(self.root, exist_ok=True)
+        df.to_parquet(data_path + '.tmp', index=False)
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump([(lo.isoformat(), hi.isoformat()) for lo, hi in covered], f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _add_indicators(self, df):
+        # Imported here: pandas_ta is heavy and only needed when new bars arrive
+        import pandas_ta  # noqa: F401 registers the .ta accessor
+
+        fast, slow, signal = self.macd
+        df.ta.macd(close='close', fast=fast, slow=slow, signal=signal, append=True)
+        return df
+
+    def get(self, symbol, bar_size, start, end):
+        """Return the bars between two dates (inclusive), fetching only what is missing"""
+        df, covered = self._load(symbol, bar_size)
+
+        fetched = []
+        if self.fetch is not None:
+            for lo, hi in missing_ranges(covered, start, end):
+                frame = self.fetch(symbol, bar_size, lo, hi)
+                fetched.append(frame)
+                if not frame.attrs.get('complete', True):
+                    continue
+                # Bars of an unfinished day must be fetched again next time
+                hi = min(hi, date.today() - timedelta(days=1))
+                if lo <= hi:
+                    covered.append((lo, hi))
+
+        fetched = [frame for frame in fetched if not frame.empty]
+        if fetched:
+            df = pd.concat([df[BAR_COLUMNS]] + [frame[BAR_COLUMNS] for frame in fetched])
+            df = df.drop_duplicates('time', keep='last').sort_values('time').reset_index(drop=True)
+            df = self._add_indicators(df)
+            self._save(symbol, bar_size, df, merge_ranges(covered))
+
+        if df.empty:
+            return df
+        times = pd.to_datetime(df['time'])
+        mask = (times >= pd.Timestamp(start)) & (times < pd.Timestamp(end + timedelta(days=1)))
+        return df[mask].reset_index(drop=True)
@@ -0,0 +1,117 @@
+import threading
+from collections import deque
+
+# Bar size name -> length in seconds
+BAR_SIZES = {'1s': 1, '5s': 5, '1m': 60, '5m': 300}
+
+NANOS = 1_000_000_000
+
+
+def bar_to_dict(bar):
+    """Serialize a bar in the lightweight-charts candlestick format"""
+    start, open_, high, low, close, volume = bar
+    return {'time': start // NANOS, 'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume}
+
+
+class BarSeries:
+    """OHLCV bars of one size, built incrementally from ticks
+
+    Bars are plain ``[start_ns, open, high, low, close, volume]`` lists. Only
+    the open bar is touched per tick; it is closed when a tick or ``roll``
+    crosses its end boundary.
+    """
+
+    def __init__(self, seconds, max_bars=1000):
+        self.seconds = seconds
+        self.step = seconds * NANOS
+        self.bars = deque(maxlen=max_bars)
+        self.current = None
+        # Closed since the last drain, and whether the open bar changed
+        self.closed = []
+        self.changed = False
+
+    def update(self, ts, price, size=0.0):
+        bar = self.current
+        if bar is None or ts >= bar[0] + self.step:
+            self._close()
+            self.current = [ts - ts % self.step, price, price, price, price, size]
+        else:
+            if price > bar[2]:
+                bar[2] = price
+            elif price < bar[3]:
+                bar[3] = price
+            bar[4] = price
+            bar[5] += size
+        self.changed = True
+
+    def add_volume(self, size):
+        if self.current is not None:
+            self.current[5] += size
+            self.changed = True
+
+    def roll(self, now):
+        """Close the open bar once ``now`` is past its end"""
+        if self.current is not None and now >= self.current[0] + self.step:
+            self._close()
+
+    def _close(self):
+        if self.current is not None:
+            self.bars.append(self.current)
+            self.closed.append(self.current)
+            self.current = None
+            self.changed = False
+
+    def drain(self):
+        """Return (closed bars, open bar or None) changed since the last drain"""
+        closed, self.closed = self.closed, []
+        current = self.current if self.changed else None
+        self.changed = False
+        return closed, current
+
+    def to_list(self):
+        bars = list(self.bars)
+        if self.current is not None:
+            bars.append(self.current)
+        return [bar_to_dict(bar) for bar in bars]
+
+
+class BarSet:
+    """All bar sizes for one symbol
+
+    Ticks arrive on the IB thread while the broadcaster rolls and drains the
+    bars, so both sides go through one uncontended lock.
+    """
+
+    def __init__(self, sizes=None, max_bars=1000):
+        sizes = BAR_SIZES if sizes is None else sizes
+        self.series = {name: BarSeries(seconds, max_bars) for name, seconds in sizes.items()}
+        self._lock = threading.Lock()
+
+    def update(self, ts, price, size=0.0):
+        with self._lock:
+            for series in self.series.values():
+                series.update(ts, price, size)
+
+    def add_volume(self, size):
+        with self._lock:
+            for series in self.series.values():
+                series.add_volume(size)
+
+    def drain(self, now):
+        """Close bars that ended before ``now`` and return what changed per size"""
+        changes = {}
+        with self._lock:
+            for name, series in self.series.items():
+                series.roll(now)
+                closed, current = series.drain()
+                if closed or current is not None:
+                    changes[name] = {
+                        'closed': [bar_to_dict(bar) for bar in closed],
+                        'open': bar_to_dict(current) if current is not None else None
+                    }
+        return changes
+
+    def bars(self, name):
+        """Return the closed bars plus the open one, oldest first"""
+        with self._lock:
+            return self.series[name].to_list()
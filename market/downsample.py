@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .tick_store import TICK_DTYPE
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+# Bucket durations the cache works with: 1-2-5 steps from 1 ms to 5 days
+LEVELS_NS = tuple(step * 10 ** exponent * 1_000_000 for exponent in range(9) for step in (1, 2, 5))
+# LTTB picks from this many min/max candidates per output point
+LTTB_PRESELECT = 4
+
+
+def level_for(span_ns, buckets):
+    """Smallest cached bucket duration that splits ``span_ns`` into at most ``buckets`` buckets"""
+    wanted = -(-max(span_ns, 1) // max(buckets, 1))
+    for level in LEVELS_NS:
+        if level >= wanted:
+            return level
+    return LEVELS_NS[-1]
+
+
+def min_max(ts, price, bucket_ns):
+    """Reduce ticks to the lowest and highest one of every ``bucket_ns`` time bucket
+
+    Buckets are aligned to multiples of ``bucket_ns`` since the epoch, so the
+    result of a range does not depend on where the range starts. Returns the
+    kept (ts, price) in time order, at most two per non-empty bucket, and the
+    number of ticks each one stands for (all of them on the first point of a
+    bucket, 0 on the second).
+    """
+    if not len(ts):
+        return ts[:0], price[:0], np.empty(0, dtype=np.int64)
+
+    buckets = ts // bucket_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(ts)])
+    segment = np.repeat(np.arange(len(starts)), counts)
+    positions = np.arange(len(ts))
+    # First position of each bucket reaching the bucket's low / high
+    lows = np.minimum.reduceat(price, starts)
+    highs = np.maximum.reduceat(price, starts)
+    low_at = np.minimum.reduceat(np.where(price == lows[segment], positions, len(ts)), starts)
+    high_at = np.minimum.reduceat(np.where(price == highs[segment], positions, len(ts)), starts)
+
+    first = np.minimum(low_at, high_at)
+    second = np.maximum(low_at, high_at)
+    keep = np.column_stack([first, second]).ravel()
+    weight = np.column_stack([counts, np.zeros_like(counts)]).ravel()
+    # Flat buckets and single ticks have one extreme, not two
+    single = np.column_stack([np.zeros(len(first), dtype=bool), first == second]).ravel()
+    keep, weight = keep[~single], weight[~single]
+    return ts[keep], price[keep], weight
+
+
+def lttb(ts, price, n):
+    """Indices of the ``n`` points Largest-Triangle-Three-Buckets keeps
+
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the point kept before it and
+    the average of the next bucket. The areas of a bucket are computed in one
+    vectorized pass, so the Python loop only runs once per output point.
+    """
+    size = len(ts)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    x = (ts - ts[0]).astype(np.float64)
+    y = np.asarray(price, dtype=np.float64)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)  # n - 2 buckets over the inner points
+    lengths = np.diff(edges)
+    mean_x = np.add.reduceat(x[:-1], edges[:-1]) / lengths
+    mean_y = np.add.reduceat(y[:-1], edges[:-1]) / lengths
+    # The last bucket looks ahead at the last point
+    mean_x = np.r_[mean_x[1:], x[-1]]
+    mean_y = np.r_[mean_y[1:], y[-1]]
+
+    kept = np.empty(n, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - mean_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[i] - ay))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+class DownsampleCache:
+    """Downsampled views of the tick history in a TickStore, for zoomed-out charts
+
+    ``downsample`` returns about ``width`` points for any time range:
+    ``minmax`` keeps the low and the high of ``width`` time buckets, ``lttb``
+    runs LTTB over four times as many min/max candidates (MinMaxLTTB).
+
+    The min/max reduction is the expensive part, and bucket sizes snap to a
+    fixed ladder (``LEVELS_NS``), so it is cached as levels of detail: per
+    symbol and bucket size, the reduced points of one contiguous time range.
+    A request inside the range is a slice; a request that extends it only
+    reads the missing ticks, e.g. the new minutes of a "full session" view.
+    Buckets younger than ``settle`` seconds may still get ticks from the
+    store's writer and are never cached. At most ``max_levels`` levels are
+    kept, least recently used first out.
+    """
+
+    def __init__(self, store, settle=2.0, max_levels=64):
+        self.store = store
+        self.settle = settle
+        self.max_levels = max_levels
+        self._levels = OrderedDict()  # (symbol, bucket ns) -> (start, end, ts, price, count)
+        self._lock = threading.Lock()
+
+    def downsample(self, symbol, start, end, width, method='lttb'):
+        """Return (ts, price, ticks) for about ``width`` points of ``symbol`` with start <= ts < end
+
+        ``ticks`` is the number of stored ticks the points stand for.
+        """
+        if method not in DOWNSAMPLE_METHODS:
+            raise ValueError(f"Unknown downsampling method {method}, use one of {DOWNSAMPLE_METHODS}")
+        # Size the buckets for the ticks actually stored, e.g. from the open rather than from midnight
+        span = self.store.span(symbol, start, end)
+        if span is not None:
+            start, end = max(start, span[0]), min(end, span[1] + 1)
+        buckets = width if method == 'minmax' else width * LTTB_PRESELECT
+        ts, price, count = self.extremes(symbol, start, end, level_for(end - start, buckets))
+        ticks = int(count.sum())
+        if method == 'lttb':
+            kept = lttb(ts, price, width)
+            ts, price = ts[kept], price[kept]
+        return ts, price, ticks
+
+    def extremes(self, symbol, start, end, bucket_ns):
+        """Min/max points of ``symbol`` in [start, end), from the cached level where possible"""
+        # Only whole buckets that stopped changing are cached; the partial ones around them are read each time
+        lo = -(-start // bucket_ns) * bucket_ns
+        settled = (time.time_ns() - int(self.settle * 1_000_000_000)) // bucket_ns * bucket_ns
+        hi = min(end // bucket_ns * bucket_ns, settled)
+        if hi <= lo:
+            return self._reduce(symbol, start, end, bucket_ns)
+
+        parts = [self._reduce(symbol, start, lo, bucket_ns), self._level(symbol, lo, hi, bucket_ns),
+                 self._reduce(symbol, hi, end, bucket_ns)]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def _reduce(self, symbol, start, end, bucket_ns):
+        ticks = self.store.read(symbol, start, end) if end > start else np.empty(0, dtype=TICK_DTYPE)
+        return min_max(ticks['ts'], ticks['price'], bucket_ns)
+
+    def _level(self, symbol, start, end, bucket_ns):
+        key = (symbol, bucket_ns)
+        with self._lock:
+            level = self._levels.get(key)
+            if level is not None:
+                self._levels.move_to_end(key)
+        if level is None or start > level[1] or end < level[0]:
+            # Nothing to reuse: this range becomes the cached one
+            level = (start, end, *self._reduce(symbol, start, end, bucket_ns))
+        elif start < level[0] or end > level[1]:
+            lo, hi = min(start, level[0]), max(end, level[1])
+            parts = [self._reduce(symbol, lo, level[0], bucket_ns), level[2:],
+                     self._reduce(symbol, level[1], hi, bucket_ns)]
+            level = (lo, hi, *(np.concatenate(column) for column in zip(*parts)))
+        with self._lock:
+            self._levels[key] = level
+            self._levels.move_to_end(key)
+            while len(self._levels) > self.max_levels:
+                self._levels.popitem(last=False)
+
+        _, _, ts, price, count = level
+        first, last = np.searchsorted(ts, [start, end])
+        return ts[first:last], price[first:last], count[first:last]
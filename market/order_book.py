@@ -0,0 +1,116 @@
+import threading
+
+# Book sides and row operations as numbered by updateMktDepth
+ASK = 0
+BID = 1
+INSERT = 0
+UPDATE = 1
+DELETE = 2
+
+SIDE_NAMES = ('asks', 'bids')
+
+
+class OrderBook:
+    """Level-2 book of one symbol, maintained the way TWS sends it
+
+    TWS addresses depth by row position: an insert shifts the rows below it
+    down, a delete shifts them up, an update replaces one row. Each side is a
+    list of ``[price, size, market_maker]`` rows capped at ``rows``, so every
+    operation is one list insert/delete/assignment - a memmove of at most
+    ``rows`` pointers - and cheap enough to run on the IB reader thread.
+
+    Besides full ``snapshot``s the book tracks, per side, the range of rows
+    changed since the last ``diff``. Updates widen it to the touched row;
+    inserts and deletes extend it to the end of the side because the rows
+    below moved. A diff carries the new rows for that range plus the side's
+    length, so a client splices it into its copy.
+    """
+
+    def __init__(self, symbol, req_id, rows=10):
+        self.symbol = symbol
+        self.req_id = req_id
+        self.rows = rows
+        self.updates = 0
+        self._sides = ([], [])
+        self._dirty = [None, None]  # per side (first, last) changed row since the last diff
+        self._lock = threading.Lock()
+
+    def apply(self, position, operation, side, price, size, market_maker=''):
+        """Apply one updateMktDepth/updateMktDepthL2 message"""
+        with self._lock:
+            rows = self._sides[side]
+            if operation == INSERT:
+                if position > len(rows):
+                    return
+                rows.insert(position, [price, float(size), market_maker])
+                if len(rows) > self.rows:
+                    rows.pop()
+                last = self.rows
+            elif operation == UPDATE:
+                if position == len(rows):
+                    # TWS may update the row just past the end instead of inserting it
+                    rows.append([price, float(size), market_maker])
+                elif position < len(rows):
+                    rows[position] = [price, float(size), market_maker]
+                else:
+                    return
+                last = position
+            elif operation == DELETE:
+                if position >= len(rows):
+                    return
+                del rows[position]
+                last = self.rows
+            else:
+                return
+
+            dirty = self._dirty[side]
+            self._dirty[side] = (position, last) if dirty is None else (min(dirty[0], position),
+                                                                         max(dirty[1], last))
+            self.updates += 1
+
+    def clear(self):
+        """Empty the book, e.g. when TWS resets depth"""
+        with self._lock:
+            for side in (ASK, BID):
+                if self._sides[side]:
+                    self._sides[side].clear()
+                    self._dirty[side] = (0, self.rows)
+
+    def best(self):
+        """(best bid, best ask) prices, None for an empty side"""
+        with self._lock:
+            asks, bids = self._sides
+            return (bids[0][0] if bids else None), (asks[0][0] if asks else None)
+
+    def snapshot(self, depth=None):
+        """Top ``depth`` rows of both sides"""
+        depth = depth or self.rows
+        with self._lock:
+            return {name: [list(row) for row in rows[:depth]] for name, rows in zip(SIDE_NAMES, self._sides)}
+
+    def diff(self, depth=None):
+        """Rows changed since the last diff, within the top ``depth``, or None
+
+        Each changed side maps to ``{'start', 'rows', 'length'}``: replace the
+        client rows from ``start`` on with ``rows`` and cut the side to
+        ``length``.
+        """
+        depth = depth or self.rows
+        changes = {}
+        with self._lock:
+            for side, name in enumerate(SIDE_NAMES):
+                dirty = self._dirty[side]
+                if dirty is None:
+                    continue
+                self._dirty[side] = None
+                first, last = dirty
+                rows = self._sides[side]
+                length = min(len(rows), depth)
+                if first >= depth:
+                    continue
+                changes[name] = {
+                    'start': first,
+                    'rows': [list(row) for row in rows[first:min(last + 1, length)]],
+                    'length': length
+                }
+        return changes or None
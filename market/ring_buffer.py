@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import numpy as np
+
+
+class TickRingBuffer:
+    """Preallocated, columnar tick history for a single symbol
+
+    Ticks are stored in three NumPy columns (epoch-ns timestamp, price, size)
+    with some slack at the end. When the slack is used up the most recent
+    ``capacity`` ticks are copied into fresh arrays, so every window is a
+    contiguous slice and can be handed out as a zero-copy view. Views taken
+    before a compaction keep pointing at the old arrays and stay valid.
+
+    Ticks are addressed by their absolute position in the stream (``count``
+    is the number of ticks ever appended), which lets consumers on other
+    threads ask for "everything since position N" without locking. There is
+    a single writer, the thread delivering ticks.
+    """
+
+    def __init__(self, capacity=100_000, slack=0.25):
+        self.capacity = capacity
+        self._allocated = capacity + max(1, int(capacity * slack))
+        # (ts, price, size, base) where base is the absolute position of row 0
+        self._columns = self._allocate(0)
+        self.count = 0
+
+    def _allocate(self, base):
+        return (np.empty(self._allocated, dtype=np.int64),
+                np.empty(self._allocated, dtype=np.float64),
+                np.zeros(self._allocated, dtype=np.float64),
+                base)
+
+    def _compact(self):
+        ts, price, size, base = self._columns
+        keep = min(self.count, self.capacity)
+        start = self.count - base - keep
+        columns = self._allocate(self.count - keep)
+        columns[0][:keep] = ts[start:start + keep]
+        columns[1][:keep] = price[start:start + keep]
+        columns[2][:keep] = size[start:start + keep]
+        # Publish the new arrays in one assignment so readers never mix generations
+        self._columns = columns
+
+    def append(self, ts, price, size=0.0):
+        if self.count - self._columns[3] == self._allocated:
+            self._compact()
+        ts_col, price_col, size_col, base = self._columns
+        row = self.count - base
+        ts_col[row] = ts
+        price_col[row] = price
+        size_col[row] = size
+        # Bump the count last so readers only see fully written rows
+        self.count += 1
+
+    def set_last_size(self, size):
+        if self.count:
+            size_col, base = self._columns[2], self._columns[3]
+            size_col[self.count - 1 - base] = size
+
+    def last(self):
+        """Return the newest tick as (ts, price, size), or None"""
+        count = self.count
+        if not count:
+            return None
+        ts, price, size, base = self._columns
+        row = count - 1 - base
+        return int(ts[row]), float(price[row]), float(size[row])
+
+    def range(self, start, stop=None):
+        """Return views of the ticks at absolute positions [start, stop)
+
+        Positions that already fell out of the window are skipped, so the
+        returned columns may be shorter than requested.
+        """
+        # Read the count before the columns: older columns always hold it
+        count = self.count if stop is None else min(stop, self.count)
+        ts, price, size, base = self._columns
+        first = max(start, count - self.capacity, base) - base
+        last = max(count - base, first)
+        return ts[first:last], price[first:last], size[first:last]
+
+    def since(self, start):
+        """Return views of the ticks from ``start`` on and the position to resume from"""
+        count = self.count
+        return self.range(start, count), count
+
+    def window(self, n=None):
+        """Return views of the newest ``n`` ticks (the whole window by default)"""
+        count = self.count
+        n = self.capacity if n is None else min(n, self.capacity)
+        return self.range(count - n, count)
+
+    def clear(self):
+        self._columns = self._allocate(0)
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        ts, price, size, _ = self._columns
+        return ts.nbytes + price.nbytes + size.nbytes
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
+def to_points(ts, price):
+    """Serialize tick columns into the chart's point dicts
+
+    Timestamps are only formatted here, on the way out, and in one vectorized
+    pass for the whole slice.
+    """
+    if not len(ts):
+        return []
+    # Render local wall-clock time, like datetime.now() used to
+    offset = datetime.now().astimezone().utcoffset()
+    local = (ts + int(offset.total_seconds() * 1_000_000_000)).view('datetime64[ns]')
+    iso = np.datetime_as_string(local, unit='us')
+    return [
+        {'timestamp': stamp[11:19], 'price': value, 'datetime': stamp}
+        for stamp, value in zip(iso.tolist(), price.tolist())
+    ]
+
+
+def to_packed(ts, price):
+    """Serialize tick columns as little-endian typed arrays for binary clients
+
+    ``times`` holds int64 epoch milliseconds and ``prices`` float64 values,
+    ready to be wrapped in a BigInt64Array/Float64Array in the browser.
+    """
+    return {
+        'times': (ts // 1_000_000).astype('<i8').tobytes(),
+        'prices': price.astype('<f8').tobytes()
+    }
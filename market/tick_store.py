@@ -0,0 +1,179 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# One fixed-size record per completed trade
+TICK_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8'), ('size', '<f8')])
+# Sparse time index: (ts, record number) of every INDEX_EVERY-th record
+INDEX_DTYPE = np.dtype([('ts', '<i8'), ('record', '<i8')])
+INDEX_EVERY = 4096
+
+DAY_NS = 86_400 * 1_000_000_000
+
+
+def day_of(ts):
+    """Return the UTC day number of an epoch-ns timestamp"""
+    return ts // DAY_NS
+
+
+class TickStore:
+    """Append-only on-disk tick history, one binary file per symbol per day
+
+    ``append`` only puts the tick on a queue; a writer thread drains it every
+    ``flush_interval`` seconds and appends each symbol/day batch with a single
+    write. Files live at ``<root>/<SYMBOL>/<YYYYMMDD>.ticks`` next to a small
+    ``.idx`` file, and reads go through a memory map, touching only the pages
+    of the requested range.
+    """
+
+    def __init__(self, root, flush_interval=1.0):
+        self.root = root
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        # (symbol, day) -> number of records already in the file
+        self._records = {}
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def append(self, symbol, ts, price, size):
+        self._queue.put((symbol, ts, price, size))
+
+    def _paths(self, symbol, day):
+        name = datetime.fromtimestamp(day * 86_400, timezone.utc).strftime('%Y%m%d')
+        base = os.path.join(self.root, symbol, name)
+        return base + '.ticks', base + '.idx'
+
+    def _writer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            batch = []
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        """Write a batch of (symbol, ts, price, size) ticks to disk"""
+        groups = {}
+        for symbol, ts, price, size in batch:
+            groups.setdefault((symbol, day_of(ts)), []).append((ts, price, size))
+
+        for (symbol, day), ticks in groups.items():
+            self._write(symbol, day, np.array(ticks, dtype=TICK_DTYPE))
+
+    def _write(self, symbol, day, records):
+        tick_path, index_path = self._paths(symbol, day)
+        key = (symbol, day)
+        if key not in self._records:
+            os.makedirs(os.path.dirname(tick_path), exist_ok=True)
+            exists = os.path.exists(tick_path)
+            self._records[key] = os.path.getsize(tick_path) // TICK_DTYPE.itemsize if exists else 0
+        first = self._records[key]
+
+        with open(tick_path, 'ab') as f:
+            f.write(records.tobytes())
+
+        # Index the records whose number is a multiple of INDEX_EVERY
+        numbers = np.arange(first, first + len(records))
+        marks = numbers % INDEX_EVERY == 0
+        if marks.any():
+            index = np.empty(int(marks.sum()), dtype=INDEX_DTYPE)
+            index['ts'] = records['ts'][marks]
+            index['record'] = numbers[marks]
+            with open(index_path, 'ab') as f:
+                f.write(index.tobytes())
+
+        self._records[key] = first + len(records)
+
+    def _days(self, symbol, start, end):
+        """Days with a tick file for ``symbol`` that overlap start <= ts < end, in order"""
+        try:
+            names = os.listdir(os.path.join(self.root, symbol))
+        except FileNotFoundError:
+            return []
+        first, last = day_of(start), day_of(end - 1)
+        days = []
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext != '.ticks':
+                continue
+            try:
+                day = int(datetime.strptime(stem, '%Y%m%d').replace(tzinfo=timezone.utc).timestamp()) // 86_400
+            except ValueError:
+                continue
+            if first <= day <= last:
+                days.append(day)
+        return sorted(days)
+
+    @staticmethod
+    def _map(tick_path):
+        """Memory-map the whole records of a tick file, or None if it has none
+
+        The writer may be in the middle of an append, so a trailing partial
+        record is left out of the map.
+        """
+        try:
+            count = os.path.getsize(tick_path) // TICK_DTYPE.itemsize
+        except FileNotFoundError:
+            return None
+        if not count:
+            return None
+        return np.memmap(tick_path, dtype=TICK_DTYPE, mode='r', offset=0, shape=(count,))
+
+    def read(self, symbol, start, end):
+        """Return the ticks of ``symbol`` with start <= ts < end as a structured array"""
+        chunks = []
+        for day in self._days(symbol, start, end):
+            chunk = self._read_day(symbol, day, start, end)
+            if chunk is not None:
+                chunks.append(chunk)
+        if not chunks:
+            return np.empty(0, dtype=TICK_DTYPE)
+        return np.concatenate(chunks)
+
+    def span(self, symbol, start, end):
+        """Return the first and last timestamps of ``symbol`` with start <= ts < end, or None"""
+        first = last = None
+        for day in self._days(symbol, start, end):
+            ticks = self._map(self._paths(symbol, day)[0])
+            if ticks is None:
+                continue
+            ts = ticks['ts']
+            lo, hi = np.searchsorted(ts, [start, end])
+            if lo < hi:
+                if first is None:
+                    first = int(ts[lo])
+                last = int(ts[hi - 1])
+        return None if first is None else (first, last)
+
+    def _read_day(self, symbol, day, start, end):
+        tick_path, index_path = self._paths(symbol, day)
+        ticks = self._map(tick_path)
+        if ticks is None:
+            return None
+
+        lo, hi = 0, len(ticks)
+        # Narrow the search to the index blocks that can hold the range
+        if os.path.exists(index_path):
+            # Whole entries only, the index may be mid-append too
+            count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=count)
+            if len(index):
+                block = np.searchsorted(index['ts'], start, side='right') - 1
+                if block > 0:
+                    lo = int(index['record'][block])
+                block = np.searchsorted(index['ts'], end, side='left')
+                if block < len(index):
+                    hi = int(index['record'][block]) + 1
+
+        window = ticks[lo:hi]
+        first = np.searchsorted(window['ts'], start, side='left')
+        last = np.searchsorted(window['ts'], end, side='left')
+        # Copy out of the map so the file can be closed
+        return np.array(window[first:last])
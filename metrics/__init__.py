@@ -0,0 +1 @@
+from .registry import REGISTRY, SOCKETIO_EMITS, Counter, Gauge, Histogram, MetricsRegistry
@@ -0,0 +1,2 @@
+from .broadcaster import BINARY, FORMATS, JSON, Broadcaster, room
+from .bus import BusClient, BusError, BusManager, BusServer
@@ -0,0 +1,344 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from market import to_packed, to_points
+from metrics import REGISTRY, SOCKETIO_EMITS
+
+# Price channel wire formats, negotiated per client; each is also a room name
+JSON = 'json'
+BINARY = 'binary'
+FORMATS = (JSON, BINARY)
+
+PRICE_EMITS = SOCKETIO_EMITS.labels('price_update')
+BINARY_EMITS = SOCKETIO_EMITS.labels('price_binary')
+BAR_EMITS = SOCKETIO_EMITS.labels('bar_update')
+DEPTH_EMITS = SOCKETIO_EMITS.labels('depth_update')
+LOG_SNAPSHOT_EMITS = SOCKETIO_EMITS.labels('log_update')
+SNAPSHOT_BUILDS = REGISTRY.counter('snapshot_builds_total', 'Connect snapshots serialized, per cache miss', ['format'])
+FRAME_SECONDS = REGISTRY.histogram('broadcast_frame_seconds', 'Time spent building and emitting one frame')
+TICK_TO_EMIT_SECONDS = REGISTRY.histogram(
+    'tick_to_emit_seconds', 'Age of the oldest tick in a price frame when it is emitted')
+CONFLATED = REGISTRY.counter('client_frames_conflated_total',
+                             'Frames held back from clients that fell behind, replaced by a snapshot')
+LAG_DISCONNECTS = REGISTRY.counter('client_lag_disconnects_total', 'Clients disconnected for lagging too far')
+
+
+def room(symbol, fmt):
+    """Socket.IO room of the clients watching a symbol in a price format"""
+    return f'{fmt}:{symbol}'
+
+
+class _Client:
+    def __init__(self, fmt, symbol):
+        self.fmt = fmt
+        self.symbol = symbol
+        self.inflight = deque()  # (seq, monotonic time) of the frames sent and not acked yet
+        self.missed = False  # frames were held back, a snapshot is due once it caught up
+
+
+class Broadcaster:
+    """Coalesces ticks into frames and emits only the points added since the last frame
+
+    The IB thread only appends to the subscription's tick buffer; a background
+    task wakes up every ``interval`` seconds and sends one ``price_update`` per
+    symbol that received ticks, carrying just the new points. Clients get the
+    full window once, from ``snapshot``. The same frame closes finished OHLCV
+    bars and sends the changed ones as ``bar_update``, and sends the rows of
+    every order book in ``books`` (reqId -> OrderBook) that changed as a
+    ``depth_update`` diff.
+
+    Clients ``watch`` one symbol in one wire format and sit in its ``room``.
+    Price frames go to the room of each format in use: ``price_update`` with
+    JSON point dicts, ``price_binary`` with packed int64 millisecond
+    timestamps and float64 prices (binary attachments). Bars and depth go to
+    the rooms of the symbol in every format. A symbol or format nobody
+    watches costs nothing.
+
+    Joining clients are not answered right away: the next frame sends every
+    snapshot once, to the list of clients that asked for it, so Socket.IO
+    encodes it once however many clients join. Snapshot payloads are cached
+    until the window they cover moves, i.e. rebuilt at most once per frame,
+    and the log snapshot comes from ``logs()`` (e.g. ``Logger.snapshot``).
+
+    Flow control: every payload carries the frame's ``seq`` and clients
+    ``ack`` the newest one they received. A client with ``max_inflight``
+    frames unacknowledged is skipped (``lagging`` lists them) and its updates
+    conflate into a single snapshot of the latest state, sent once it caught
+    up. A client whose oldest unacknowledged frame is ``max_lag`` seconds old
+    is disconnected. ``max_inflight=None`` turns flow control off.
+
+    A frame that fails is logged to ``logger`` and the next one goes out as
+    usual.
+    """
+
+    def __init__(self, socketio, subscriptions, interval=0.1, snapshot_points=500, books=None, logs=None,
+                 max_inflight=20, max_lag=30.0, logger=None):
+        self.socketio = socketio
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.subscriptions = subscriptions
+        self.books = books if books is not None else {}
+        self.logs = logs
+        self.interval = interval
+        self.snapshot_points = snapshot_points
+        self.max_inflight = max_inflight
+        self.max_lag = max_lag
+        self.running = False
+        self.seq = 0  # number of the frame being sent
+        # reqId -> absolute tick position already broadcast
+        self._sent = {}
+        self._clients = {}  # sid -> _Client
+        self._rooms = defaultdict(set)  # (wire format, symbol) -> sids
+        self._joins = []  # (sid, wire format, symbol, logs) waiting for the next frame
+        self._snapshots = {}  # (reqId, wire format) -> (window end, payload)
+        self._lock = threading.Lock()
+        # Aggregated over clients; a series per sid would grow with every client that ever connected
+        REGISTRY.gauge('client_lag_frames', 'Frames sent to clients and not acknowledged yet', ['stat'],
+                       callback=lambda: self._aggregate([len(c.inflight) for c in list(self._clients.values())]))
+        REGISTRY.gauge('client_lag_seconds', 'Age of the oldest frame clients have not acknowledged', ['stat'],
+                       callback=self._lag_seconds)
+
+    def watch(self, sid, fmt, symbol, logs=False):
+        """Point a client at a symbol and format; its snapshots go out with the next frame"""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                client = self._clients[sid] = _Client(fmt, symbol)
+            else:
+                self._rooms[(client.fmt, client.symbol)].discard(sid)
+                client.fmt, client.symbol = fmt, symbol
+            self._rooms[(fmt, symbol)].add(sid)
+            self._joins.append((sid, fmt, symbol, logs))
+
+    def forget(self, sid):
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            if client is not None:
+                self._rooms[(client.fmt, client.symbol)].discard(sid)
+
+    def ack(self, sid, seq):
+        """A client received every frame up to ``seq``"""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            inflight = client.inflight
+            while inflight and inflight[0][0] <= seq:
+                inflight.popleft()
+            if client.missed and not self._behind(client):
+                # Conflation: one snapshot of the latest state instead of every frame it missed
+                client.missed = False
+                self._joins.append((sid, client.fmt, client.symbol, True))
+
+    def format_of(self, sid):
+        client = self._clients.get(sid)
+        return client.fmt if client is not None else JSON
+
+    def watched(self, symbol):
+        """Formats in which someone watches a symbol"""
+        return [fmt for fmt in FORMATS if self._rooms.get((fmt, symbol))]
+
+    def lagging(self):
+        """Clients that currently get no updates because they fell behind"""
+        return [sid for sid, client in list(self._clients.items()) if self._behind(client)]
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.socketio.start_background_task(self.run)
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                # One bad frame must not stop broadcasting for good
+                self.logger.error(f"Broadcast frame failed: {str(e)}")
+
+    def flush(self):
+        """Send the snapshots of joining clients, then one frame of new points for every symbol that ticked"""
+        start = time.perf_counter()
+        self.seq += 1
+        self.disconnect_lagging()
+        # Snapshots end where the last frame ended, so they go out before this frame's deltas
+        self.send_snapshots()
+
+        sent = {}
+        now = time.time_ns()
+        for subscription in self.subscriptions:
+            symbol = subscription.symbol
+            formats = self.watched(symbol)
+            bars = subscription.bars.drain(now)
+            if bars and formats:
+                self._emit('bar_update', {'symbol': symbol, 'bars': bars, 'seq': self.seq}, symbol, formats)
+                BAR_EMITS.inc()
+
+            (ts, price, _), position = subscription.ticks.since(self._sent.get(subscription.req_id, 0))
+            sent[subscription.req_id] = position
+            if not len(ts) or not formats:
+                continue
+
+            calculations = subscription.analytics.snapshot()
+            if JSON in formats:
+                points = to_points(ts, price)
+                last = points[-1]
+                self._emit('price_update', {
+                    'symbol': symbol,
+                    'price': last['price'],
+                    'timestamp': last['timestamp'],
+                    'data': points,
+                    'calculations': calculations,
+                    'seq': self.seq
+                }, symbol, [JSON])
+                PRICE_EMITS.inc()
+            if BINARY in formats:
+                self._emit('price_binary', {
+                    'symbol': symbol,
+                    **to_packed(ts, price),
+                    'calculations': calculations,
+                    'seq': self.seq
+                }, symbol, [BINARY])
+                BINARY_EMITS.inc()
+            TICK_TO_EMIT_SECONDS.observe((time.time_ns() - int(ts[0])) / 1e9)
+        # Rebuilding the maps also forgets cancelled subscriptions
+        self._sent = sent
+        self._snapshots = {key: value for key, value in self._snapshots.items() if key[0] in sent}
+
+        for book in list(self.books.values()):
+            diff = book.diff()
+            formats = self.watched(book.symbol)
+            if diff is not None and formats:
+                self._emit('depth_update', {'symbol': book.symbol, **diff, 'seq': self.seq}, book.symbol, formats)
+                DEPTH_EMITS.inc()
+        FRAME_SECONDS.observe(time.perf_counter() - start)
+
+    def send_snapshots(self):
+        """Emit each pending snapshot once, to all the clients that joined since the last frame"""
+        with self._lock:
+            joins, self._joins = self._joins, []
+        if not joins:
+            return
+
+        groups = defaultdict(list)  # (wire format, symbol) -> sids
+        log_sids = []
+        for sid, fmt, symbol, logs in joins:
+            groups[(fmt, symbol)].append(sid)
+            if logs:
+                log_sids.append(sid)
+
+        if log_sids and self.logs is not None:
+            self.socketio.emit('log_update', self.logs(), to=log_sids)
+            LOG_SNAPSHOT_EMITS.inc()
+        books = {book.symbol: book for book in list(self.books.values())}
+        for (fmt, symbol), sids in groups.items():
+            subscription = self.subscriptions.by_symbol(symbol)
+            payload = self.snapshot(subscription, fmt) if subscription is not None else None
+            if payload is not None:
+                # The cached payload is shared; only the small outer dict is copied to add the seq
+                self._emit('price_binary' if fmt == BINARY else 'price_update', {**payload, 'seq': self.seq},
+                           to=sids)
+                (BINARY_EMITS if fmt == BINARY else PRICE_EMITS).inc()
+            book = books.get(symbol)
+            if book is not None:
+                self._emit('depth_update', {**self.depth_snapshot(book), 'seq': self.seq}, to=sids)
+                DEPTH_EMITS.inc()
+
+    def disconnect_lagging(self):
+        """Drop the clients that have not acknowledged a frame for ``max_lag`` seconds"""
+        if self.max_inflight is None:
+            return
+        deadline = time.monotonic() - self.max_lag
+        stale = [sid for sid, client in list(self._clients.items())
+                 if client.inflight and client.inflight[0][1] < deadline]
+        for sid in stale:
+            self.forget(sid)
+            LAG_DISCONNECTS.inc()
+            self.socketio.server.disconnect(sid)
+
+    def _behind(self, client):
+        return self.max_inflight is not None and len(client.inflight) >= self.max_inflight
+
+    def _emit(self, event, payload, symbol=None, formats=(), to=None):
+        """Emit a frame to the rooms of a symbol, or to a list of sids, minus the clients that fell behind"""
+        if to is None:
+            target = [room(symbol, fmt) for fmt in formats]
+        else:
+            target = to
+
+        skip = []
+        if self.max_inflight is not None:
+            now = time.monotonic()
+            with self._lock:
+                # watch/forget change the room sets from other threads
+                if to is None:
+                    recipients = [sid for fmt in formats for sid in list(self._rooms.get((fmt, symbol), ()))]
+                else:
+                    recipients = to
+                for sid in recipients:
+                    client = self._clients.get(sid)
+                    if client is None:
+                        continue
+                    if self._behind(client):
+                        client.missed = True
+                        skip.append(sid)
+                        CONFLATED.inc()
+                    elif not client.inflight or client.inflight[-1][0] != self.seq:
+                        client.inflight.append((self.seq, now))
+        self.socketio.emit(event, payload, to=target, skip_sid=skip or None)
+
+    def _lag_seconds(self):
+        now = time.monotonic()
+        return self._aggregate([now - client.inflight[0][1] if client.inflight else 0.0
+                                for client in list(self._clients.values())])
+
+    @staticmethod
+    def _aggregate(values):
+        return {('max',): max(values, default=0), ('sum',): sum(values)}
+
+    def snapshot(self, subscription, fmt=JSON):
+        """Return the full-window payload for a joining client, or None
+
+        The window ends where the last frame ended, so the client does not get
+        the same points again with the next delta. Payloads are shared: the
+        same dict is returned until the window moves.
+        """
+        end = self._sent.get(subscription.req_id, 0)
+        key = (subscription.req_id, fmt)
+        cached = self._snapshots.get(key)
+        if cached is not None and cached[0] == end:
+            return cached[1]
+
+        ts, price, _ = subscription.ticks.range(end - self.snapshot_points, end)
+        if not len(ts):
+            return None
+
+        SNAPSHOT_BUILDS.labels(fmt).inc()
+        if fmt == BINARY:
+            payload = {
+                'symbol': subscription.symbol,
+                **to_packed(ts, price),
+                'calculations': subscription.analytics.snapshot(),
+                'snapshot': True
+            }
+        else:
+            points = to_points(ts, price)
+            last = points[-1]
+            payload = {
+                'symbol': subscription.symbol,
+                'price': last['price'],
+                'timestamp': last['timestamp'],
+                'data': points,
+                'calculations': subscription.analytics.snapshot(),
+                'snapshot': True
+            }
+        self._snapshots[key] = (end, payload)
+        return payload
+
+    def depth_snapshot(self, book):
+        """Return the whole book for a joining client"""
+        return {'symbol': book.symbol, 'snapshot': True, **book.snapshot()}
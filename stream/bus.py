@@ -0,0 +1,285 @@
+import itertools
+import os
+import pickle
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from socketio import PubSubManager
+
+from metrics import REGISTRY
+
+# Frames are a 4-byte big-endian length followed by a pickled dict
+HEADER = struct.Struct('!I')
+
+PUBLISHED = REGISTRY.counter('bus_published_total', 'Messages published to the web workers')
+DROPPED = REGISTRY.counter('bus_dropped_total', 'Messages dropped because a web worker fell behind')
+REQUESTS = REGISTRY.counter('bus_requests_total', 'Requests served for the web workers', ['method'])
+
+
+class BusError(Exception):
+    pass
+
+
+def _frame(message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(data)) + data
+
+
+def _read_frame(rfile):
+    """Next message from a buffered socket file, None at the end of the stream"""
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    data = rfile.read(HEADER.unpack(header)[0])
+    return pickle.loads(data)
+
+
+class _Peer:
+    def __init__(self, peer_id, sock, capacity):
+        self.id = peer_id
+        self.sock = sock
+        self.capacity = capacity
+        self.outbox = deque()
+        self.wakeup = threading.Event()
+        self.closed = False
+
+    def send(self, frame, droppable=True):
+        if droppable and len(self.outbox) >= self.capacity:
+            try:
+                self.outbox.popleft()
+            except IndexError:
+                pass
+            DROPPED.inc()
+        self.outbox.append(frame)
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class BusServer:
+    """Ingest end of the local message bus, a Unix socket
+
+    ``publish`` sends a message to every connected web worker. Each worker
+    has a bounded outbox drained by its own writer thread, so a slow worker
+    only delays, and past ``capacity`` loses, its own messages. A message is
+    pickled once however many workers there are.
+
+    Workers also send requests; they run on a small thread pool and
+    ``handler(peer, method, kwargs)`` returns the reply. ``on_close(peer)``
+    is called when a worker goes away.
+    """
+
+    def __init__(self, path, capacity=100_000, workers=8):
+        self.path = path
+        self.capacity = capacity
+        self.logger = None
+        self._peers = {}
+        self._ids = itertools.count(1)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='bus')
+        REGISTRY.gauge('bus_workers', 'Web workers connected to the bus', callback=lambda: len(self._peers))
+        REGISTRY.gauge('bus_outbox_depth', 'Messages waiting to be sent per web worker', ['worker'],
+                       callback=lambda: {(str(p.id),): len(p.outbox) for p in list(self._peers.values())})
+
+    def publish(self, message):
+        frame = _frame({'publish': message})
+        for peer in list(self._peers.values()):
+            peer.send(frame)
+        PUBLISHED.inc()
+
+    def serve_forever(self, handler, logger, on_close=None):
+        """Accept web workers until the process ends"""
+        self.logger = logger
+        # A socket file left behind by a previous run would make bind fail
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Requests are unpickled, so only this user may connect; the socket file
+        # must be created 0600 rather than chmod-ed after bind
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        logger.info(f"Bus listening on {self.path}")
+        while True:
+            sock, _ = server.accept()
+            peer = _Peer(next(self._ids), sock, self.capacity)
+            self._peers[peer.id] = peer
+            threading.Thread(target=self._writer, args=(peer,), daemon=True).start()
+            threading.Thread(target=self._reader, args=(peer, handler, on_close), daemon=True).start()
+            logger.info(f"Web worker {peer.id} connected")
+
+    def _writer(self, peer):
+        outbox = peer.outbox
+        while not peer.closed:
+            peer.wakeup.wait()
+            peer.wakeup.clear()
+            if not outbox:
+                continue
+            # One send for everything queued since the last wake-up
+            data = b''.join([outbox.popleft() for _ in range(len(outbox))])
+            try:
+                peer.sock.sendall(data)
+            except OSError:
+                peer.close()
+
+    def _reader(self, peer, handler, on_close):
+        try:
+            rfile = peer.sock.makefile('rb')
+            while (request := _read_frame(rfile)) is not None:
+                self._pool.submit(self._serve, peer, handler, request)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        self._peers.pop(peer.id, None)
+        peer.close()
+        self.logger.info(f"Web worker {peer.id} disconnected")
+        if on_close is not None:
+            on_close(peer.id)
+
+    def _serve(self, peer, handler, request):
+        REQUESTS.labels(request['method']).inc()
+        try:
+            reply = {'id': request['id'], 'result': handler(peer.id, request['method'], request['kwargs'])}
+        except Exception as e:
+            self.logger.error(f"Bus request {request['method']} failed: {str(e)}")
+            reply = {'id': request['id'], 'error': str(e)}
+        peer.send(_frame(reply), droppable=False)
+
+
+class BusClient:
+    """Web worker end of the local message bus
+
+    Received publications are queued in ``published`` for the BusManager.
+    ``call`` sends a request to the ingest process and waits for its reply.
+    The client keeps reconnecting while the ingest process is down or being
+    restarted; calls fail fast with BusError in the meantime, and
+    ``on_connect`` runs (on its own thread) after every successful connect.
+    """
+
+    def __init__(self, path, timeout=30.0, retry=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry = retry
+        self.logger = None
+        self.published = queue.SimpleQueue()
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._pending = {}  # request id -> [Event, reply]
+        self._ids = itertools.count()
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def start(self, logger, on_connect=None):
+        self.logger = logger
+        threading.Thread(target=self._run, args=(on_connect,), daemon=True).start()
+
+    def publish(self, message):
+        """Messages published by a worker itself only concern its own clients"""
+        self.published.put(message)
+
+    def call(self, method, /, **kwargs):
+        sock = self._sock
+        if sock is None:
+            raise BusError('Not connected to the ingest process')
+
+        request_id = next(self._ids)
+        pending = self._pending[request_id] = [threading.Event(), None]
+        try:
+            with self._send_lock:
+                sock.sendall(_frame({'id': request_id, 'method': method, 'kwargs': kwargs}))
+        except OSError as e:
+            self._pending.pop(request_id, None)
+            raise BusError(f'Sending {method} to the ingest process failed: {str(e)}') from e
+
+        if not pending[0].wait(self.timeout):
+            self._pending.pop(request_id, None)
+            raise BusError(f'The ingest process did not answer {method} within {self.timeout}s')
+        reply = pending[1]
+        if reply is None:
+            raise BusError('Lost the ingest process')
+        if 'error' in reply:
+            raise BusError(reply['error'])
+        return reply['result']
+
+    def _run(self, on_connect):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                time.sleep(self.retry)
+                continue
+
+            self._sock = sock
+            self.logger.info(f"Connected to the ingest process on {self.path}")
+            if on_connect is not None:
+                # Callbacks usually call() and need this thread to read the replies
+                threading.Thread(target=on_connect, daemon=True).start()
+            try:
+                self._read(sock)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+
+            self._sock = None
+            sock.close()
+            for request_id in list(self._pending):
+                pending = self._pending.pop(request_id, None)
+                if pending is not None:
+                    pending[0].set()
+            self.logger.error("Lost the ingest process, reconnecting")
+
+    def _read(self, sock):
+        rfile = sock.makefile('rb')
+        while (message := _read_frame(rfile)) is not None:
+            if 'publish' in message:
+                self.published.put(message['publish'])
+                continue
+            pending = self._pending.pop(message['id'], None)
+            if pending is not None:
+                pending[1] = message
+                pending[0].set()
+
+
+class BusManager(PubSubManager):
+    """Socket.IO client manager that carries emits over the local bus
+
+    In the ingest process (``write_only``) every emit is published to the web
+    workers, which emit it to their own clients. Emits made by a worker
+    itself, e.g. replies to one of its clients, go straight to its listener.
+    """
+
+    name = 'bus'
+
+    def __init__(self, bus, write_only=False, logger=None):
+        super().__init__(write_only=write_only, logger=logger)
+        self.bus = bus
+        self._initialized = False
+
+    def initialize(self):
+        # Workers start listening before their first client connects (see app.py); once is enough
+        if not self._initialized:
+            self._initialized = True
+            super().initialize()
+
+    def _publish(self, data):
+        self.bus.publish(data)
+
+    def _listen(self):
+        while True:
+            yield self.bus.published.get()
@@ -0,0 +1,56 @@
+import logging
+
+from ibapi.common import HistoricalTickLast
+
+from ib import FakeTWS, TWSConnection, stock_contract
+
+SECOND = 1_000_000_000
+
+
+def historical_tick(time, price, size):
+    tick = HistoricalTickLast()
+    tick.time, tick.price, tick.size = time, price, size
+    return tick
+
+
+def test_backfill_keeps_unseen_ticks_of_the_last_second():
+    tws = TWSConnection(logging.getLogger(__name__), None)
+    subscription = tws.subscriptions.add(1, 'AAPL', stock_contract('AAPL'))
+    last_second = 1_800_000_000
+    for offset, price, size in ((0.2, 10.0, 1.0), (0.5, 11.0, 2.0)):
+        subscription.on_last_price(int((last_second + offset) * SECOND), price)
+        subscription.on_last_size(int((last_second + offset) * SECOND), size)
+    last_ts = subscription.ticks.last()[0]
+
+    count = tws.apply_backfill(subscription, [
+        historical_tick(last_second - 1, 9.0, 1.0),  # Before the drop
+        historical_tick(last_second, 10.0, 1.0),  # Seen live
+        historical_tick(last_second, 11.0, 2.0),  # Seen live
+        historical_tick(last_second, 12.0, 3.0),  # Same second, missed
+        historical_tick(last_second + 1, 13.0, 1.0),
+    ], last_ts)
+
+    ts, price, size = subscription.ticks.window()
+    assert count == 2
+    assert price.tolist() == [10.0, 11.0, 12.0, 13.0]
+    assert size.tolist() == [1.0, 2.0, 3.0, 1.0]
+    assert (ts[1:] >= ts[:-1]).all()
+
+
+def test_backfill_only_requests_what_historical_pacing_allows():
+    tws = TWSConnection(logging.getLogger(__name__), None)
+    FakeTWS().attach(tws)
+    tws.start_connect()
+    subscriptions = []
+    for i in range(5):
+        subscription = tws.subscriptions.add(i + 1, f'S{i}', stock_contract(f'S{i}'))
+        subscription.on_last_price(SECOND, 10.0)
+        subscriptions.append(subscription)
+    sent = []
+    tws.reqHistoricalTicks = lambda request_id, *args: sent.append(request_id)
+    tws.scheduler.historical.tokens = 2
+
+    tws.backfill(subscriptions, timeout=0.5)
+
+    assert len(sent) == 2
+    assert not tws._historical
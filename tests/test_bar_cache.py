@@ -0,0 +1,46 @@
+from datetime import date
+
+import pandas as pd
+
+from market import HistoricalBarCache
+from market.bar_cache import BAR_COLUMNS
+
+
+class Fetcher:
+    """Records the requested ranges and answers with one bar at the end of each"""
+
+    def __init__(self, complete):
+        self.complete = complete
+        self.calls = []
+
+    def __call__(self, symbol, bar_size, start, end):
+        self.calls.append((start, end))
+        frame = pd.DataFrame([(pd.Timestamp(end), 1.0, 1.0, 1.0, 1.0, 100.0)], columns=BAR_COLUMNS)
+        frame.attrs['complete'] = self.complete
+        return frame
+
+
+def test_incomplete_fetch_is_not_marked_covered(tmp_path):
+    fetch = Fetcher(complete=False)
+    cache = HistoricalBarCache(str(tmp_path), fetch)
+    cache._add_indicators = lambda df: df
+    cache._save('AAPL', '1 day', pd.DataFrame(columns=BAR_COLUMNS), [(date(2026, 2, 10), date(2026, 2, 20))])
+
+    cache.get('AAPL', '1 day', date(2026, 1, 1), date(2026, 2, 20))
+    bars = cache.get('AAPL', '1 day', date(2026, 1, 1), date(2026, 2, 20))
+
+    assert fetch.calls == [(date(2026, 1, 1), date(2026, 2, 9))] * 2
+    # The partial bars are kept all the same
+    assert list(bars['time']) == [pd.Timestamp(2026, 2, 9)]
+
+
+def test_missing_ranges_only_are_fetched(tmp_path):
+    fetch = Fetcher(complete=True)
+    cache = HistoricalBarCache(str(tmp_path), fetch)
+    cache._add_indicators = lambda df: df
+    cache._save('AAPL', '1 day', pd.DataFrame(columns=BAR_COLUMNS), [(date(2026, 1, 10), date(2026, 1, 20))])
+
+    cache.get('AAPL', '1 day', date(2026, 1, 1), date(2026, 1, 31))
+    cache.get('AAPL', '1 day', date(2026, 1, 1), date(2026, 1, 31))
+
+    assert fetch.calls == [(date(2026, 1, 1), date(2026, 1, 9)), (date(2026, 1, 21), date(2026, 1, 31))]
@@ -0,0 +1,41 @@
+import sys
+import threading
+
+from stream import JSON, Broadcaster
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, payload, to=None, skip_sid=None):
+        self.emitted.append((event, to, skip_sid))
+
+
+def test_emit_while_clients_join_and_leave():
+    broadcaster = Broadcaster(FakeSocketIO(), [])
+    for n in range(1000):
+        broadcaster.watch(f'viewer{n}', JSON, 'AAPL')
+    stop = threading.Event()
+
+    def churn(offset):
+        n = 0
+        while not stop.is_set():
+            sid = f'sid{offset + n % 50}'
+            broadcaster.watch(sid, JSON, 'AAPL')
+            broadcaster.forget(sid)
+            n += 1
+
+    threads = [threading.Thread(target=churn, args=(i * 100,)) for i in range(4)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads often enough to hit the race
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(300):
+            broadcaster._emit('price_update', {}, 'AAPL', [JSON])
+    finally:
+        sys.setswitchinterval(interval)
+        stop.set()
+        for thread in threads:
+            thread.join()
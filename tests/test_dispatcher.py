@@ -0,0 +1,78 @@
+import logging
+import threading
+
+from ib.dispatcher import PRICE, QUOTE, SIZE, TickDispatcher
+
+
+class BlockingHandler:
+    """Holds up the first batch so the shard behind it fills up"""
+
+    def __init__(self):
+        self.handled = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, batch):
+        self.started.set()
+        self.release.wait(5)
+        self.handled.extend(batch)
+
+
+def test_conflate_keeps_order_and_sizes_with_prices():
+    handler = BlockingHandler()
+    dispatcher = TickDispatcher(handler, logging.getLogger(__name__), capacity=2, policy='conflate')
+
+    dispatcher.submit(PRICE, 1, 1.0, 1)
+    assert handler.started.wait(5)
+    # Fills the shard
+    dispatcher.submit(PRICE, 1, 2.0, 2)
+    dispatcher.submit(SIZE, 1, 20, 3)
+    # Conflated: only the newest price and the size that followed it survive
+    dispatcher.submit(PRICE, 1, 3.0, 4)
+    dispatcher.submit(SIZE, 1, 30, 5)
+    dispatcher.submit(PRICE, 1, 4.0, 6)
+    dispatcher.submit(SIZE, 1, 40, 7)
+    handler.release.set()
+    assert dispatcher.wait_idle()
+
+    # Once drained, records queue normally again
+    dispatcher.submit(PRICE, 1, 5.0, 8)
+    dispatcher.submit(SIZE, 1, 50, 9)
+    assert dispatcher.wait_idle()
+
+    assert [(kind, value) for kind, _, value, _ in handler.handled] == [
+        (PRICE, 1.0), (PRICE, 2.0), (SIZE, 20), (PRICE, 4.0), (SIZE, 40), (PRICE, 5.0), (SIZE, 50)
+    ]
+    assert [ts for *_, ts in handler.handled] == sorted(ts for *_, ts in handler.handled)
+
+
+def test_conflate_keeps_size_of_queued_price():
+    handler = BlockingHandler()
+    dispatcher = TickDispatcher(handler, logging.getLogger(__name__), capacity=1, policy='conflate')
+
+    dispatcher.submit(PRICE, 1, 1.0, 1)
+    assert handler.started.wait(5)
+    dispatcher.submit(PRICE, 1, 2.0, 2)
+    # The size of the queued price is conflated, the next price must not take it
+    dispatcher.submit(SIZE, 1, 20, 3)
+    dispatcher.submit(PRICE, 1, 3.0, 4)
+    dispatcher.submit(SIZE, 1, 30, 5)
+    handler.release.set()
+    assert dispatcher.wait_idle()
+
+    assert [(kind, value) for kind, _, value, _ in handler.handled] == [
+        (PRICE, 1.0), (PRICE, 2.0), (SIZE, 20), (PRICE, 3.0), (SIZE, 30)
+    ]
+
+
+def test_shard_key_keeps_streams_of_a_symbol_together():
+    seen = []
+    dispatcher = TickDispatcher(lambda batch: seen.extend((threading.current_thread().name, r[1]) for r in batch),
+                                logging.getLogger(__name__), shards=4)
+
+    # Trades on reqId 1, quotes on reqId 2, both for the subscription with reqId 1
+    dispatcher.submit(PRICE, 1, 1.0, 1)
+    dispatcher.submit(QUOTE, 2, (0.9, 1.1, 100, 100), 2, shard_key=1)
+    assert dispatcher.wait_idle()
+
+    assert len({thread for thread, _ in seen}) == 1
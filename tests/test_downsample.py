@@ -0,0 +1,72 @@
+import numpy as np
+
+from market import DownsampleCache, TickStore, lttb, min_max
+
+
+def test_min_max_buckets_align_to_the_epoch():
+    ts = np.array([10, 15, 19, 20, 29, 30], dtype=np.int64)
+    price = np.array([5.0, 7.0, 6.0, 1.0, 1.0, 3.0])
+
+    kept_ts, kept_price, weight = min_max(ts, price, 10)
+
+    # [10, 20) keeps its low then its high, the flat [20, 30) and the single tick at 30 one point each
+    assert kept_ts.tolist() == [10, 15, 20, 30]
+    assert kept_price.tolist() == [5.0, 7.0, 1.0, 3.0]
+    assert weight.tolist() == [3, 0, 2, 1]
+    assert weight.sum() == len(ts)
+
+
+def test_min_max_keeps_extremes_in_time_order():
+    ts = np.arange(4, dtype=np.int64)
+    price = np.array([2.0, 9.0, 1.0, 1.0])
+
+    kept_ts, kept_price, _ = min_max(ts, price, 10)
+
+    # The high comes first; of the two lows the first one is kept
+    assert kept_ts.tolist() == [1, 2]
+    assert kept_price.tolist() == [9.0, 1.0]
+
+
+def test_min_max_of_nothing():
+    kept_ts, kept_price, weight = min_max(np.empty(0, dtype=np.int64), np.empty(0), 10)
+    assert len(kept_ts) == len(kept_price) == len(weight) == 0
+
+
+def test_lttb_keeps_first_last_and_spikes():
+    ts = np.arange(100, dtype=np.int64) * 1000
+    price = np.zeros(100)
+    price[37] = 50.0
+
+    kept = lttb(ts, price, 10)
+
+    assert len(kept) == 10
+    assert kept[0] == 0 and kept[-1] == 99
+    assert np.all(np.diff(kept) > 0)
+    assert 37 in kept
+
+
+def test_lttb_returns_everything_when_there_is_nothing_to_drop():
+    ts = np.arange(5, dtype=np.int64)
+    assert lttb(ts, np.ones(5), 5).tolist() == [0, 1, 2, 3, 4]
+    assert lttb(ts, np.ones(5), 2).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_cached_levels_match_a_fresh_reduction(tmp_path):
+    store = TickStore(str(tmp_path))
+    rng = np.random.default_rng(0)
+    start = 1_700_000_000 * 1_000_000_000
+    ts = start + np.sort(rng.integers(0, 60_000_000_000, 2000))
+    price = 100 + np.cumsum(rng.normal(0, 0.1, 2000))
+    store.flush([('AAPL', int(t), float(p), 1.0) for t, p in zip(ts, price)])
+    cache = DownsampleCache(store)
+    bucket = 1_000_000_000
+    end = start + 60_000_000_000
+
+    # A narrow view first, then one that extends the cached level on both sides
+    cache.extremes('AAPL', start + 20_000_000_000, start + 40_000_000_000, bucket)
+    cached = cache.extremes('AAPL', start, end, bucket)
+    ticks = store.read('AAPL', start, end)
+    fresh = min_max(ticks['ts'], ticks['price'], bucket)
+
+    for got, expected in zip(cached, fresh):
+        assert got.tolist() == expected.tolist()
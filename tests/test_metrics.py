@@ -0,0 +1,22 @@
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_callback_gauge_rebinds_to_newest_owner():
+    registry = MetricsRegistry()
+    first = registry.gauge('queue_depth', 'Queued items', callback=lambda: 1)
+    second = registry.gauge('queue_depth', 'Queued items', callback=lambda: 2)
+
+    assert second is first
+    assert 'queue_depth 2.0' in registry.render()
+
+
+def test_duplicate_metric_raises():
+    registry = MetricsRegistry()
+    registry.counter('emits_total', 'Events emitted', ['event'])
+
+    with pytest.raises(ValueError):
+        registry.counter('emits_total', 'Events emitted', ['event'])
+    with pytest.raises(ValueError):
+        registry.gauge('emits_total', 'Events emitted', callback=lambda: 0)
@@ -0,0 +1,61 @@
+from market import OrderBook
+from market.order_book import ASK, BID, DELETE, INSERT, UPDATE
+
+
+def book_with_bids(*prices, rows=10):
+    book = OrderBook('AAPL', 1, rows=rows)
+    for position, price in enumerate(prices):
+        book.apply(position, INSERT, BID, price, 100)
+    book.diff()
+    return book
+
+
+def test_out_of_range_operations_are_ignored():
+    book = book_with_bids(10.0, 9.9)
+
+    book.apply(3, INSERT, BID, 9.7, 100)
+    book.apply(3, UPDATE, BID, 9.7, 100)
+    book.apply(2, DELETE, BID, 0, 0)
+    book.apply(0, DELETE, ASK, 0, 0)
+
+    assert book.snapshot()['bids'] == [[10.0, 100.0, ''], [9.9, 100.0, '']]
+    assert book.diff() is None
+    assert book.updates == 2
+
+
+def test_update_just_past_the_end_appends():
+    book = book_with_bids(10.0)
+
+    book.apply(1, UPDATE, BID, 9.9, 200)
+
+    assert book.diff() == {'bids': {'start': 1, 'rows': [[9.9, 200.0, '']], 'length': 2}}
+
+
+def test_delete_at_position_shifts_rows_up():
+    book = book_with_bids(10.0, 9.9, 9.8, 9.7)
+
+    book.apply(1, DELETE, BID, 0, 0)
+
+    assert book.diff() == {'bids': {'start': 1, 'rows': [[9.8, 100.0, ''], [9.7, 100.0, '']], 'length': 3}}
+
+
+def test_insert_pushes_the_last_row_out():
+    book = book_with_bids(10.0, 9.8, rows=2)
+
+    book.apply(1, INSERT, BID, 9.9, 50)
+
+    assert book.snapshot()['bids'] == [[10.0, 100.0, ''], [9.9, 50.0, '']]
+    assert book.diff() == {'bids': {'start': 1, 'rows': [[9.9, 50.0, '']], 'length': 2}}
+
+
+def test_diff_merges_changes_and_respects_depth():
+    book = book_with_bids(10.0, 9.9, 9.8, 9.7)
+
+    book.apply(3, UPDATE, BID, 9.6, 100)
+    book.apply(2, UPDATE, BID, 9.5, 100)
+    assert book.diff(depth=2) is None
+
+    book.apply(3, UPDATE, BID, 9.4, 100)
+    book.apply(1, UPDATE, BID, 9.95, 100)
+    assert book.diff() == {'bids': {'start': 1, 'rows': [[9.95, 100.0, ''], [9.5, 100.0, ''], [9.4, 100.0, '']],
+                                    'length': 4}}
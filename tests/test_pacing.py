@@ -0,0 +1,17 @@
+import logging
+import threading
+
+from ib.pacing import REQUEST, RequestScheduler
+
+
+def test_drained_historical_bucket_only_delays_historical_calls():
+    scheduler = RequestScheduler(logging.getLogger(__name__), rate=1000, historical_rate=0.001, historical_burst=2)
+    sent = []
+    plain = threading.Event()
+
+    for i in range(3):
+        scheduler.submit(REQUEST, sent.append, i, historical=True)
+    scheduler.submit(REQUEST, plain.set)
+
+    assert plain.wait(2)
+    assert 2 not in sent  # Still waiting for a historical token
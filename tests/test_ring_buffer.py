@@ -0,0 +1,52 @@
+from market import TickRingBuffer
+
+
+def fill(buffer, n, first=0):
+    for i in range(first, first + n):
+        buffer.append(i, float(i), i * 10.0)
+
+
+def test_window_wraps_to_the_newest_ticks():
+    buffer = TickRingBuffer(capacity=4, slack=0.5)
+    fill(buffer, 11)
+
+    ts, price, size = buffer.window()
+    assert ts.tolist() == [7, 8, 9, 10]
+    assert price.tolist() == [7.0, 8.0, 9.0, 10.0]
+    assert size.tolist() == [70.0, 80.0, 90.0, 100.0]
+    assert len(buffer) == 4
+    assert buffer.last() == (10, 10.0, 100.0)
+
+
+def test_compaction_keeps_positions_and_old_views():
+    buffer = TickRingBuffer(capacity=4, slack=0.5)
+    fill(buffer, 6)
+    before = buffer.window()[0]
+
+    # The seventh tick does not fit the slack and moves the window to fresh arrays
+    fill(buffer, 1, first=6)
+
+    assert before.tolist() == [2, 3, 4, 5]
+    assert buffer.window()[0].tolist() == [3, 4, 5, 6]
+    (ts, _, _), position = buffer.since(4)
+    assert ts.tolist() == [4, 5, 6]
+    assert position == 7
+
+
+def test_range_skips_positions_out_of_the_window():
+    buffer = TickRingBuffer(capacity=4, slack=0.5)
+    fill(buffer, 10)
+
+    assert buffer.range(0)[0].tolist() == [6, 7, 8, 9]
+    assert buffer.range(7, 9)[0].tolist() == [7, 8]
+    assert buffer.range(12)[0].tolist() == []
+    assert buffer.window(2)[0].tolist() == [8, 9]
+
+
+def test_set_last_size_after_compaction():
+    buffer = TickRingBuffer(capacity=2, slack=0.5)
+    fill(buffer, 3)
+
+    buffer.set_last_size(5.0)
+
+    assert buffer.last() == (2, 2.0, 5.0)
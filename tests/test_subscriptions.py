@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+
+from ib import CANCELLED, FakeTWS, TWSConnection, stock_contract
+
+
+def connected_tws():
+    tws = TWSConnection(logging.getLogger(__name__), None)
+    FakeTWS().attach(tws)
+    tws.start_connect()
+    tws.contracts.cached = stock_contract
+    return tws
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_queued_cancel_dropped_on_disconnect_ends_cancelled():
+    tws = connected_tws()
+    subscription, = tws.subscribe_many(['AAPL'])
+    assert wait_for(lambda: subscription.requested)
+
+    tws.scheduler.messages.tokens = -1e6  # Hold every further call in the queue
+    tws.cancel_market_data('AAPL')
+    tws.start_disconnect()
+
+    assert tws.subscriptions.lookup(subscription.req_id).state == CANCELLED
+
+
+def test_concurrent_subscribes_share_one_subscription():
+    tws = connected_tws()
+    sent = []
+    tws.send_market_data_request = sent.append
+    # A slow contract lookup widens the window between looking up and adding
+    tws.contracts.cached = lambda symbol: time.sleep(0.05) or stock_contract(symbol)
+    barrier = threading.Barrier(8)
+
+    def subscribe():
+        barrier.wait()
+        tws.subscribe_many(['AAPL'])
+
+    threads = [threading.Thread(target=subscribe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(list(tws.subscriptions)) == 1
+    assert wait_for(lambda: sent)
+    time.sleep(0.2)
+    assert len(sent) == 1